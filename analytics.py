@@ -0,0 +1,264 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_COLUMNS = ['user_id', 'lis_result_sourcedid', 'attempt_type', 'is_correct', 'created_at']
+
+
+def encode(values, index):
+    """
+    Целочисленные коды значений values по общему для всех пачек
+    словарю index (значение -> код)
+    """
+    codes, uniques = pd.factorize(values)
+    mapping = np.fromiter(
+        (index.setdefault(value, len(index)) for value in uniques),
+        dtype=np.int32, count=len(uniques))
+    return mapping[codes]
+
+
+def load_attempts(rows_chunks):
+    """
+    Сборка попыток из пачек строк ATTEMPT_COLUMNS в таблицу с колонками
+    user, task (категории), submit, correct и created_at. Строковые
+    колонки пачек сразу заменяются кодами, поэтому в памяти хранятся
+    только массивы NumPy.
+    """
+    users = dict()
+    tasks = dict()
+    columns = {'user': [], 'task': [], 'submit': [], 'correct': [], 'created_at': []}
+    for rows in rows_chunks:
+        chunk = pd.DataFrame.from_records(rows, columns=ATTEMPT_COLUMNS)
+        submit = (chunk['attempt_type'] == 'submit').to_numpy()
+        columns['user'].append(encode(chunk['user_id'], users))
+        columns['task'].append(encode(chunk['lis_result_sourcedid'], tasks))
+        columns['submit'].append(submit)
+        columns['correct'].append(submit & (chunk['is_correct'] == 1).to_numpy())
+        columns['created_at'].append(
+            pd.to_datetime(chunk['created_at']).to_numpy(dtype='datetime64[us]'))
+    if not columns['user']:
+        return None
+    return pd.DataFrame({
+        'user': pd.Categorical.from_codes(
+            np.concatenate(columns['user']), categories=pd.Index(list(users))),
+        'task': pd.Categorical.from_codes(
+            np.concatenate(columns['task']), categories=pd.Index(list(tasks))),
+        'submit': np.concatenate(columns['submit']),
+        'correct': np.concatenate(columns['correct']),
+        'created_at': np.concatenate(columns['created_at']),
+    })
+
+
+def compute_progress(attempts):
+    """
+    Прогресс по каждой паре (пользователь, задание): количество попыток
+    и отправок, доля верных отправок, номер попытки и время (с) от первой
+    попытки до первого верного решения. Попытки сортируются по паре
+    и времени, итоги пар считаются по границам групп в отсортированных
+    массивах.
+    """
+    user_codes = attempts['user'].cat.codes.to_numpy()
+    task_codes = attempts['task'].cat.codes.to_numpy()
+    created_at = attempts['created_at'].to_numpy()
+    pair_keys = user_codes.astype(np.int64) * len(attempts['task'].cat.categories) + task_codes
+    order = np.lexsort((created_at, pair_keys))
+    pair_keys = pair_keys[order]
+    created_at = created_at[order]
+    submit = attempts['submit'].to_numpy()[order]
+    correct = attempts['correct'].to_numpy()[order]
+
+    is_start = np.empty(len(pair_keys), dtype=bool)
+    is_start[0] = True
+    np.not_equal(pair_keys[1:], pair_keys[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    pair_ids = np.cumsum(is_start) - 1
+    attempt_numbers = np.arange(len(pair_keys)) - starts[pair_ids] + 1
+
+    submits = np.add.reduceat(submit.astype(np.int64), starts)
+    correct_count = np.add.reduceat(correct.astype(np.int64), starts)
+    first_attempt_at = created_at[starts]
+
+    correct_rows = np.flatnonzero(correct)
+    solved_pairs, first_rows = np.unique(pair_ids[correct_rows], return_index=True)
+    first_correct_rows = correct_rows[first_rows]
+    attempts_to_first_correct = np.full(len(starts), np.nan)
+    attempts_to_first_correct[solved_pairs] = attempt_numbers[first_correct_rows]
+    time_to_first_correct = np.full(len(starts), np.nan)
+    time_to_first_correct[solved_pairs] = (
+        created_at[first_correct_rows] - first_attempt_at[solved_pairs]
+    ) / np.timedelta64(1, 's')
+
+    index = pd.MultiIndex.from_arrays([
+        pd.Categorical.from_codes(
+            user_codes[order][starts], categories=attempts['user'].cat.categories),
+        pd.Categorical.from_codes(
+            task_codes[order][starts], categories=attempts['task'].cat.categories),
+    ], names=['user', 'task'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        success_rate = np.where(submits > 0, correct_count / submits, np.nan)
+    return pd.DataFrame({
+        'attempts': np.diff(np.append(starts, len(pair_keys))),
+        'submits': submits,
+        'correct': correct_count,
+        'first_attempt_at': first_attempt_at,
+        'attempts_to_first_correct': attempts_to_first_correct,
+        'success_rate': success_rate,
+        'time_to_first_correct': time_to_first_correct,
+    }, index=index)
+
+
+def compute_users(progress):
+    """
+    Итоги по пользователям и недельная когорта (неделя первой попытки)
+    """
+    users = progress.groupby(level='user', observed=True).agg(
+        attempts=('attempts', 'sum'),
+        submits=('submits', 'sum'),
+        correct=('correct', 'sum'),
+        tasks=('attempts', 'size'),
+        solved=('attempts_to_first_correct', 'count'),
+        first_attempt_at=('first_attempt_at', 'min'),
+    )
+    users['success_rate'] = users['correct'] / users['submits'].where(users['submits'] > 0)
+    users['cohort'] = users['first_attempt_at'].dt.to_period('W').dt.start_time.dt.date
+    return users
+
+
+def compute_tasks(progress):
+    """
+    Итоги по заданиям: количество пользователей, доля решивших,
+    распределение попыток и времени до первого верного решения
+    """
+    groups = progress.groupby(level='task', observed=True)
+    tasks = groups.agg(
+        users=('attempts', 'size'),
+        solved=('attempts_to_first_correct', 'count'),
+        attempts_median=('attempts', 'median'),
+        attempts_to_first_correct_median=('attempts_to_first_correct', 'median'),
+        time_to_first_correct_median=('time_to_first_correct', 'median'),
+    )
+    tasks['attempts_to_first_correct_p90'] = groups['attempts_to_first_correct'].quantile(0.9)
+    tasks['solve_rate'] = tasks['solved'] / tasks['users']
+    return tasks
+
+
+def compute_cohorts(progress, users):
+    """
+    Распределения по недельным когортам: квартили доли верных отправок,
+    медианы решённых заданий, попыток и времени до первого верного решения
+    """
+    groups = users.groupby('cohort')
+    cohorts = groups.agg(
+        users=('tasks', 'size'),
+        tasks_median=('tasks', 'median'),
+        solved_median=('solved', 'median'),
+    )
+    success_rate = groups['success_rate'].quantile([0.25, 0.5, 0.75]).unstack()
+    cohorts['success_rate_p25'] = success_rate[0.25]
+    cohorts['success_rate_median'] = success_rate[0.5]
+    cohorts['success_rate_p75'] = success_rate[0.75]
+    cohort_progress = progress.join(users['cohort'], on='user').groupby('cohort')
+    cohorts['attempts_to_first_correct_median'] = (
+        cohort_progress['attempts_to_first_correct'].median())
+    cohorts['time_to_first_correct_median'] = (
+        cohort_progress['time_to_first_correct'].median())
+    return cohorts
+
+
+def analyze(students_grade, start_date=None, end_date=None, chunk_size=100000):
+    """
+    Аналитика прогресса студентов за период [start_date, end_date]:
+    таблицы progress (пользователь и задание), users, tasks и cohorts.
+    Возвращает None, если за период нет попыток.
+    """
+    started = perf_counter()
+    attempts = load_attempts(students_grade.iter_attempts(start_date, end_date, chunk_size))
+    if attempts is None:
+        logger.info(f'Нет попыток за период {start_date} - {end_date}')
+        return None
+    loaded = perf_counter()
+    progress = compute_progress(attempts)
+    users = compute_users(progress)
+    results = {
+        'progress': progress,
+        'users': users,
+        'tasks': compute_tasks(progress),
+        'cohorts': compute_cohorts(progress, users),
+    }
+    logger.info(f'Аналитика по {len(attempts)} попыткам: загрузка {loaded - started:.2f} с, '
+                f'расчёт {perf_counter() - loaded:.2f} с')
+    return results
+
+
+def save_results(results, output_dir):
+    """
+    Сохранение таблиц аналитики в файлы CSV
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, table in results.items():
+        table.to_csv(output_dir / f'{name}.csv')
+    logger.info(f'Таблицы аналитики сохранены в {output_dir}')
+
+
+def cell(value, digits=3):
+    """
+    Значение для таблицы Google и письма: числа NumPy в числа Python,
+    пропуски в пустую строку
+    """
+    if pd.isna(value):
+        return ''
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), digits)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def create_report(results, hardest_tasks=5):
+    """
+    Формирование текста письма и строк таблицы: одна строка на каждую
+    когорту, в письме также задания с наименьшей долей решивших
+    """
+    cohorts = results['cohorts']
+    sheet_data = [
+        ['Когорта (неделя)',
+         'Пользователей',
+         'Решено заданий (медиана)',
+         'Доля верных отправок (медиана)',
+         'Доля верных отправок (25%)',
+         'Доля верных отправок (75%)',
+         'Попыток до первого верного (медиана)',
+         'Время до первого верного, ч (медиана)'],
+        *([row.Index.isoformat(),
+           cell(row.users),
+           cell(row.solved_median),
+           cell(row.success_rate_median),
+           cell(row.success_rate_p25),
+           cell(row.success_rate_p75),
+           cell(row.attempts_to_first_correct_median),
+           cell(row.time_to_first_correct_median / 3600, 2)]
+          for row in cohorts.itertuples()),
+    ]
+    msg_lines = [
+        f'''{row.Index}: Пользователей {cell(row.users)};
+                      Решено заданий (медиана) {cell(row.solved_median)};
+                      Доля верных отправок (медиана) {cell(row.success_rate_median)};
+                      Попыток до первого верного (медиана) {cell(row.attempts_to_first_correct_median)}'''
+        for row in cohorts.itertuples()
+    ]
+    hardest = results['tasks'].nsmallest(hardest_tasks, 'solve_rate')
+    msg_lines.append('Задания с наименьшей долей решивших:')
+    msg_lines.extend(
+        f'{row.Index}: решили {cell(row.solved)} из {cell(row.users)} '
+        f'(попыток до первого верного, медиана {cell(row.attempts_to_first_correct_median)})'
+        for row in hardest.itertuples()
+    )
+    return '\n'.join(msg_lines), sheet_data
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from datetime import timezone
+from pathlib import Path
+from time import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Кэш ответов API на диске: одно окно (client, start, end) хранится
+    в отдельном сжатом файле JSON lines. Окна, записанные в кэш после
+    своего окончания (UTC), не меняются и хранятся без ограничения
+    по времени, остальные окна - не дольше ttl секунд. При превышении max_bytes удаляются
+    файлы, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, cache_dir='cache', max_bytes=512 * 1024 * 1024, ttl=300):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, client, window_start, window_end):
+        key = f'{client}|{window_start.isoformat()}|{window_end.isoformat()}'
+        return self.cache_dir / f'{hashlib.sha1(key.encode()).hexdigest()}.jsonl.gz'
+
+    def is_immutable(self, window_end, modified):
+        """
+        Окно не изменится, если файл записан после окончания окна:
+        окно, записанное до окончания, могло содержать не все записи
+        """
+        return modified >= window_end.replace(tzinfo=timezone.utc).timestamp()
+
+    def get(self, client, window_start, window_end):
+        """
+        Записи окна из кэша или None, если окна нет или оно устарело
+        """
+        path = self.get_path(client, window_start, window_end)
+        try:
+            modified = path.stat().st_mtime
+            if not self.is_immutable(window_end, modified) \
+                    and time() - modified > self.ttl:
+                return None
+            with gzip.open(path, 'rt', encoding='utf-8') as cache_file:
+                students_data = [json.loads(line) for line in cache_file]
+            os.utime(path, (time(), modified))
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        logger.info(f'Окно {window_start} - {window_end} получено из кэша')
+        return students_data
+
+    def put(self, client, window_start, window_end, students_data):
+        path = self.get_path(client, window_start, window_end)
+        temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as cache_file:
+            for student_data in students_data:
+                cache_file.write(json.dumps(student_data, ensure_ascii=False))
+                cache_file.write('\n')
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Удаление давно не использованных файлов до размера max_bytes
+        """
+        cache_files = list()
+        for path in self.cache_dir.glob('*.jsonl.gz'):
+            try:
+                cache_files.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        total_size = sum(stat.st_size for stat, _ in cache_files)
+        for stat, path in sorted(cache_files, key=lambda cache_file: cache_file[0].st_atime):
+            if total_size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+            logger.info(f'Файл кэша {path.name} удалён')
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+
+import requests_to_simulative as rs
+import db_operations as db
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timedelta
+from functools import partial
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_stage(session, client, client_key, windows, batches, executor,
+                      fetch_workers, batch_size, api_url, cache=None):
+    """
+    Загрузка и разбор окон в потоках executor: не больше fetch_workers
+    окон одновременно. Разобранные записи передаются в очередь пачками
+    по batch_size.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(fetch_workers)
+
+    async def fetch(window_start, window_end):
+        async with semaphore:
+            students_data = await loop.run_in_executor(executor, partial(
+                rs.fetch_window, session, client, client_key,
+                window_start, window_end, api_url=api_url, cache=cache))
+            formatted_data = await loop.run_in_executor(
+                executor, lambda: list(rs.format_for_db(students_data)))
+            for batch in db.batched(formatted_data, batch_size):
+                await batches.put(batch)
+
+    tasks = [asyncio.create_task(fetch(*window)) for window in windows]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def write_stage(students_grade, batches, executor, batch_size, commit_every, method):
+    """
+    Запись в базу данных в потоке executor: одна загрузка
+    insert_students_data читает записи из пачек очереди до None, как
+    load_students_data, поэтому соединение берётся из пула один раз,
+    а транзакция фиксируется каждые commit_every строк
+    """
+    loop = asyncio.get_running_loop()
+
+    def consume():
+        while (batch := asyncio.run_coroutine_threadsafe(
+                batches.get(), loop).result()) is not None:
+            yield from batch
+
+    return await loop.run_in_executor(executor, partial(
+        students_grade.insert_students_data, consume(),
+        batch_size=batch_size, commit_every=commit_every, method=method))
+
+
+def stop_writers(batches, writers):
+    """
+    Остановка потоков записи после ошибки или отмены: пачки, ещё не взятые
+    из очереди, отбрасываются, и каждый поток получает None, чтобы
+    зафиксировать уже записанные строки и освободить соединение. Очередь
+    вмещает не меньше пачек, чем потоков записи.
+    """
+    while not batches.empty():
+        batches.get_nowait()
+    for _ in writers:
+        batches.put_nowait(None)
+
+
+async def publish_stage(students_data, publishers):
+    """
+    Одновременная публикация отчёта всеми получателями (таблица, почта)
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=len(publishers),
+                            thread_name_prefix='publish') as executor:
+        results = await asyncio.gather(
+            *(loop.run_in_executor(executor, publisher, students_data)
+              for publisher in publishers),
+            return_exceptions=True
+        )
+    for publisher, result in zip(publishers, results):
+        if isinstance(result, Exception):
+            logger.error(f'Ошибка публикации {publisher.__name__}: {repr(result)}')
+
+
+async def run_engine(students_grade, client, client_key, start_date, end_date,
+                     publishers=(), window='day', fetch_workers=4, db_workers=2,
+                     batch_size=1000, commit_every=10000, method='copy',
+                     queue_size=8, api_url=rs.API_URL, cache=None):
+    """
+    Асинхронная загрузка данных за период [start_date, end_date) и отчёт
+    по дням периода. Загрузка окон, запись в базу и публикация выполняются
+    параллельно, каждая стадия в своём пуле потоков: fetch_workers потоков
+    загрузки и разбора, db_workers потоков записи. Ошибка загрузки или
+    записи отменяет загрузку окон, остальные задачи записи фиксируют уже
+    полученные строки и завершаются. Каждая задача записи занимает одно
+    соединение с базой данных.
+    """
+    started = perf_counter()
+    period_start = dt.fromisoformat(start_date)
+    period_end = dt.fromisoformat(end_date)
+    windows = rs.split_period(period_start, period_end, rs.WINDOWS[window])
+    batches = asyncio.Queue(maxsize=max(queue_size, db_workers))
+    fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers,
+                                        thread_name_prefix='fetch')
+    write_executor = ThreadPoolExecutor(max_workers=db_workers,
+                                        thread_name_prefix='write')
+    try:
+        with rs.create_session(fetch_workers) as session:
+            writers = [
+                asyncio.create_task(
+                    write_stage(students_grade, batches, write_executor,
+                                batch_size, commit_every, method))
+                for _ in range(db_workers)
+            ]
+
+            async def fetch_all():
+                await fetch_stage(session, client, client_key, windows, batches,
+                                  fetch_executor, fetch_workers, batch_size, api_url, cache)
+                for _ in writers:
+                    await batches.put(None)
+
+            fetching = asyncio.create_task(fetch_all())
+            try:
+                _, *results = await asyncio.gather(fetching, *writers)
+            finally:
+                fetching.cancel()
+                stop_writers(batches, writers)
+                await asyncio.gather(fetching, *writers, return_exceptions=True)
+        inserted = sum(writer_inserted for writer_inserted, _ in results)
+        failed = sum(writer_failed for _, writer_failed in results)
+        logger.info(f'Загружено {inserted} записей за {perf_counter() - started:.2f} с, '
+                    f'ошибок записи: {failed}')
+        report_end = max(period_start, period_end - timedelta(days=1))
+        students_data = await asyncio.get_running_loop().run_in_executor(
+            write_executor, students_grade.fetch_daily_metrics,
+            period_start.date(), report_end.date())
+    finally:
+        fetch_executor.shutdown(wait=False, cancel_futures=True)
+        write_executor.shutdown(wait=False)
+    if students_data and publishers:
+        await publish_stage(students_data, publishers)
+    logger.info(f'Загрузка и отчёт выполнены за {perf_counter() - started:.2f} с')
+    return students_data
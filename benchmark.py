@@ -0,0 +1,478 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tracemalloc
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+import requests_to_simulative as rs
+import db_operations as db
+import metrics
+
+
+BENCH_DB_NAME = 'simulative_bench'
+FIRST_CREATED_AT = datetime(2023, 4, 1)
+STARTUP_MODULES = ('simulative', 'db_operations')
+STARTUP_FORBIDDEN = ('gspread', 'oauth2client', 'smtplib', 'email', 'requests', 'asyncio',
+                     'pandas', 'numpy')
+COURSES = ['DST-3.0+28FEB2021', 'DSPR-2.0+14JULY2021', 'PYTHON-1.0+01SEP2022']
+
+
+def make_records(count, seed=0, users=None, tasks=None):
+    """
+    Генератор синтетических записей API грейдера: несколько вариантов
+    passback_params, неравномерная активность пользователей и задач,
+    около 30% отправленных решений
+    """
+    generator = random.Random(seed)
+    users = users or max(count // 50, 1)
+    tasks = tasks or max(count // 200, 10)
+    created_at = FIRST_CREATED_AT
+    for _ in range(count):
+        course = generator.choice(COURSES)
+        task = f'{int(generator.paretovariate(1.5) * 104729) % tasks:032x}'
+        source = f'course-v1:SkillFactory+{course}:lms.skillfactory.ru-{task}:{task}'
+        url = (f'https://lms.skillfactory.ru/courses/course-v1:SkillFactory+{course}'
+               f'/xblock/block-v1:SkillFactory+{course}+type@lti+block@{task}'
+               f'/handler_noauth/grade_handler')
+        consumer_key = generator.choice(['', '', 'c3ce0ec0ee5d10b7adc2e8a2d0f1b6d9'])
+        if generator.random() < 0.2:
+            passback_params = (f"{{'oauth_consumer_key': '{consumer_key}', "
+                               f"'lis_result_sourcedid': '{source}'}}")
+        else:
+            passback_params = (f"{{'oauth_consumer_key': '{consumer_key}', "
+                               f"'lis_result_sourcedid': '{source}', "
+                               f"'lis_outcome_service_url': '{url}'}}")
+        attempt_type = 'submit' if generator.random() < 0.3 else 'run'
+        created_at += timedelta(milliseconds=generator.randint(1, 2000))
+        yield {
+            'lti_user_id': f'{int(generator.paretovariate(1.2) * 7919) % users:08x}',
+            'passback_params': passback_params,
+            'is_correct': generator.choice([0, 1]) if attempt_type == 'submit' else None,
+            'attempt_type': attempt_type,
+            'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+        }
+
+
+def format_for_db_legacy(students_data):
+    """
+    Исходная реализация format_for_db, используемая для сравнения
+    """
+    formatted_data = list()
+    for student_data in students_data:
+        db_data = dict()
+        db_data['user_id'] = student_data.get('lti_user_id')
+        if not db_data.get('user_id'):
+            continue
+        passback_params = student_data.get('passback_params')
+        if not passback_params:
+            continue
+        passback_params = passback_params.split(',')
+        passback_params = [passback_param.strip().replace("'", '').replace('}', '').split(' ')
+                           for passback_param in passback_params]
+        db_data['oauth_consumer_key'] = passback_params[0][1] if passback_params[0][1] else None
+        db_data['lis_result_sourcedid'] = passback_params[1][1]
+        db_data['lis_outcome_service_url'] = passback_params[2][1] if len(
+            passback_params) == 3 else None
+        db_data['is_correct'] = student_data.get('is_correct')
+        db_data['attempt_type'] = student_data.get('attempt_type')
+        db_data['created_at'] = datetime.strptime(
+            student_data.get('created_at'), "%Y-%m-%d %H:%M:%S.%f")
+        formatted_data.append(db_data)
+    return formatted_data
+
+
+def bench_parse(count, seed=0, check_size=10000):
+    """
+    Сравнение скорости разбора записей исходной и текущей реализацией.
+    Исходная реализация возвращает список, текущая разбирается потоково,
+    как в конвейере загрузки, поэтому замеры выполняются по очереди
+    и результаты не хранятся одновременно. Совпадение результатов
+    проверяется на первых check_size записях. Кэш разбора passback_params
+    очищается перед замером, чтобы текущая реализация не использовала
+    результаты предыдущих замеров.
+    """
+    records = list(make_records(count, seed))
+    sample = records[:check_size]
+    legacy = [rs.StudentRecord(**db_data) for db_data in format_for_db_legacy(sample)]
+    if legacy != list(rs.format_for_db(sample)):
+        raise AssertionError('Результаты разбора отличаются от исходной реализации')
+    del legacy
+    gc.collect()
+    started = perf_counter()
+    legacy_count = len(format_for_db_legacy(records))
+    legacy_elapsed = perf_counter() - started
+    gc.collect()
+    rs.parse_passback_values.cache_clear()
+    started = perf_counter()
+    current_count = sum(1 for _ in rs.format_for_db(records))
+    current_elapsed = perf_counter() - started
+    if legacy_count != current_count:
+        raise AssertionError('Количество разобранных записей отличается от исходной реализации')
+    return {
+        'records': count,
+        'legacy_seconds': round(legacy_elapsed, 3),
+        'current_seconds': round(current_elapsed, 3),
+        'records_per_second': round(count / current_elapsed),
+        'speedup': round(legacy_elapsed / current_elapsed, 2),
+    }
+
+
+def bench_parse_throughput(count, seed=0, chunk_size=100_000, trace_memory=False):
+    """
+    Скорость разбора записей и пиковая память. Записи генерируются
+    частями по chunk_size, время генерации в замер не входит.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    elapsed = 0
+    parsed = 0
+    for chunk in db.batched(make_records(count, seed), chunk_size):
+        started = perf_counter()
+        parsed += sum(1 for _ in rs.format_for_db(chunk))
+        elapsed += perf_counter() - started
+    result = {
+        'records': count,
+        'parsed': parsed,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(parsed / elapsed) if elapsed else None,
+    }
+    if trace_memory:
+        result['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def import_time(module):
+    """
+    Время импорта модуля в отдельном интерпретаторе по данным -X importtime.
+    Возвращает время в миллисекундах и множество загруженных модулей.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    cumulative = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        imported.add(name.strip())
+        if name.strip() == module:
+            cumulative = int(cumulative_us)
+    return cumulative / 1000, imported
+
+
+def bench_startup(budget_ms, repeats=5):
+    """
+    Проверка времени запуска командных модулей: медиана времени импорта
+    не должна превышать budget_ms, интеграции с Google Sheets, почтой
+    и API не должны загружаться при импорте
+    """
+    results = dict()
+    for module in STARTUP_MODULES:
+        timings = list()
+        for _ in range(repeats):
+            elapsed, imported = import_time(module)
+            timings.append(elapsed)
+        forbidden = sorted(
+            name for name in imported
+            if name.split('.')[0] in STARTUP_FORBIDDEN
+            and name.split('.')[0] not in STARTUP_MODULES
+        )
+        results[module] = {
+            'import_ms': round(statistics.median(timings), 3),
+            'budget_ms': budget_ms,
+            'forbidden_imports': forbidden,
+        }
+    return results
+
+
+def check_startup(startup):
+    errors = list()
+    for module, result in startup.items():
+        if result['import_ms'] > result['budget_ms']:
+            errors.append(f'импорт {module} занимает {result["import_ms"]} мс '
+                          f'при бюджете {result["budget_ms"]} мс')
+        if result['forbidden_imports']:
+            errors.append(f'при импорте {module} загружаются '
+                          f'{", ".join(result["forbidden_imports"])}')
+    return errors
+
+
+def bench_record_memory(count, seed=0):
+    """
+    Память, занимаемая разобранными записями: словари исходной реализации
+    и записи StudentRecord с интернированными строками. Записи проходят
+    через json, как ответ API, чтобы строки каждой записи были отдельными
+    объектами.
+    """
+    records = json.loads(json.dumps(list(make_records(count, seed))))
+    result = {'records': count}
+    for name, format_for_db in (('legacy', format_for_db_legacy),
+                                ('current', rs.format_for_db)):
+        tracemalloc.start()
+        formatted_data = list(format_for_db(records))
+        result[f'{name}_bytes'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del formatted_data
+    result['bytes_per_record'] = round(result['current_bytes'] / count, 1)
+    result['reduction'] = round(result['legacy_bytes'] / result['current_bytes'], 2)
+    return result
+
+
+def bench_analytics(count, seed=0, chunk_size=100_000):
+    """
+    Скорость аналитики прогресса: сборка попыток в массивы и расчёт
+    таблиц progress, users, tasks и cohorts без базы данных
+    """
+    import analytics
+
+    rows = [(record.user_id, record.lis_result_sourcedid, record.attempt_type,
+             record.is_correct, record.created_at)
+            for record in rs.format_for_db(make_records(count, seed))]
+    chunks = (rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size))
+    started = perf_counter()
+    attempts = analytics.load_attempts(chunks)
+    loaded = perf_counter()
+    progress = analytics.compute_progress(attempts)
+    computed = perf_counter()
+    users = analytics.compute_users(progress)
+    analytics.compute_tasks(progress)
+    cohorts = analytics.compute_cohorts(progress, users)
+    finished = perf_counter()
+    return {
+        'attempts': len(attempts),
+        'pairs': len(progress),
+        'users': len(users),
+        'cohorts': len(cohorts),
+        'load_seconds': round(loaded - started, 3),
+        'progress_seconds': round(computed - loaded, 3),
+        'aggregate_seconds': round(finished - computed, 3),
+        'attempts_per_second': round(len(attempts) / (finished - started)),
+    }
+
+
+def percentiles(latencies):
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'p50_ms': round(quantiles[49] * 1000, 3),
+        'p99_ms': round(quantiles[98] * 1000, 3),
+    }
+
+
+def measure(function, repeats, *args):
+    latencies = list()
+    for _ in range(repeats):
+        started = perf_counter()
+        function(*args)
+        latencies.append(perf_counter() - started)
+    return percentiles(latencies)
+
+
+def bench_database(db_pool, count, seed=0, batch_size=1000, method='copy',
+                   repeats=20, db_name=BENCH_DB_NAME):
+    """
+    Скорость загрузки записей и задержка отчётных запросов
+    на отдельной базе данных db_name: query_N_day - подсчёт по students_grade,
+    query_N_day_cached - чтение показателя из дневной сводки
+    """
+    simulative = db.SimulativeDB(db_pool, db_name)
+    simulative.create_database()
+    simulative.create_table()
+    students_grade = db.StudentDAO(db_pool, db_name)
+    students_grade.clear_students_data()
+    students_data = rs.format_for_db(make_records(count, seed))
+    started = perf_counter()
+    inserted, failed = students_grade.insert_students_data(
+        students_data, batch_size=batch_size, method=method)
+    elapsed = perf_counter() - started
+    first_day = FIRST_CREATED_AT.date()
+    last_day = first_day + timedelta(seconds=count)
+    return {
+        'records': count,
+        'inserted': inserted,
+        'failed': failed,
+        'insert_seconds': round(elapsed, 3),
+        'insert_rows_per_second': round(inserted / elapsed) if elapsed else None,
+        'daily_metrics_period': measure(
+            students_grade.fetch_daily_metrics, repeats, first_day, last_day),
+        'daily_metrics_day': measure(
+            students_grade.fetch_daily_metrics, repeats, first_day, first_day),
+        **{
+            f'query_{num_query}_day': measure(
+                students_grade.fetch_students_data, repeats, num_query, first_day, False)
+            for num_query in range(1, 4)
+        },
+        **{
+            f'query_{num_query}_day_cached': measure(
+                students_grade.fetch_students_data, repeats, num_query, first_day)
+            for num_query in range(1, 4)
+        },
+        'report_cache': {
+            name: value for name, value in metrics.summary()['counters'].items()
+            if name.startswith('report_cache')
+        },
+    }
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Замеры производительности'
+    )
+    parser.add_argument(
+        '-n',
+        '--sizes',
+        type=int,
+        nargs='*',
+        default=[10_000, 1_000_000],
+        help='Количество синтетических записей (несколько значений через пробел)',
+        required=False,
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Начальное значение генератора',
+        required=False,
+    )
+    parser.add_argument(
+        '--compare',
+        help='Сравнение скорости разбора и памяти записей с исходной реализацией format_for_db',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--trace-memory',
+        help='Замер пиковой памяти разбора через tracemalloc',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--analytics',
+        help='Замер скорости аналитики прогресса студентов (pandas и NumPy)',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--db',
+        help='Замеры загрузки и запросов на локальной базе PostgreSQL',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Количество записей в одной пачке при загрузке',
+        required=False,
+    )
+    parser.add_argument(
+        '--insert-method',
+        choices=['copy', 'values'],
+        default='copy',
+        help='Способ загрузки: COPY FROM STDIN или execute_values',
+        required=False,
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=20,
+        help='Количество повторов каждого запроса',
+        required=False,
+    )
+    parser.add_argument(
+        '--startup',
+        help='Проверка времени запуска simulative.py и db_operations.py через -X importtime',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--startup-budget',
+        type=float,
+        default=150,
+        help='Допустимое время импорта командного модуля, мс',
+        required=False,
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Файл для сохранения результатов в формате JSON',
+        required=False,
+    )
+    return parser.parse_args()
+
+
+def run_size(size, args):
+    """
+    Замеры для size записей. Каждый размер замеряется в новом процессе,
+    поэтому max_rss_kb - пиковая память именно этого замера, а не всех
+    предыдущих.
+    """
+    db_pool = None
+    if args.db:
+        load_dotenv()
+        db_pool = db.DatabasePool(environ['USER'],
+                                  environ['PASSWORD'],
+                                  environ['HOST'],
+                                  int(environ['PORT']))
+    try:
+        run = {
+            'records': size,
+            'parse': bench_parse_throughput(size, args.seed,
+                                            trace_memory=args.trace_memory),
+        }
+        if args.compare:
+            run['compare'] = bench_parse(size, args.seed)
+            run['record_memory'] = bench_record_memory(size, args.seed)
+        if args.analytics:
+            run['analytics'] = bench_analytics(size, args.seed)
+        if db_pool:
+            run['database'] = bench_database(
+                db_pool, size, args.seed, args.batch_size,
+                args.insert_method, args.repeats)
+        run['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return run
+    finally:
+        if db_pool:
+            db_pool.disconnect()
+
+
+def main():
+    args = create_parser()
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'runs': list(),
+    }
+    spawn = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            results['runs'].append(executor.submit(run_size, size, args).result())
+    errors = list()
+    if args.startup:
+        results['startup'] = bench_startup(args.startup_budget)
+        errors = check_startup(results['startup'])
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding='utf-8')
+    print(output)
+    if errors:
+        raise SystemExit('Превышен бюджет запуска: ' + '; '.join(errors))
+
+
+if __name__ == '__main__':
+    main()
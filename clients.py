@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+
+import requests_to_simulative as rs
+import db_operations as db
+import metrics
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_NAME = 'simulative'
+
+
+def load_clients(clients_path):
+    """
+    Чтение списка клиентов из файла JSON вида
+    [{"client": ..., "client_key": ..., "name": ..., "start": ..., "end": ..., "db_name": ...}].
+    Обязательны client и client_key. Если задан период start - end,
+    клиент загружается за период (дата end включительно), иначе синхронизируется с отметки
+    последней синхронизации (при первом запуске - с даты start).
+    """
+    with open(clients_path, encoding='utf-8') as clients_file:
+        clients = json.load(clients_file)
+    names = set()
+    for client_config in clients:
+        missing = [key for key in ('client', 'client_key') if not client_config.get(key)]
+        if missing:
+            raise ValueError(f'В описании клиента {client_config} нет {", ".join(missing)}')
+        client_config.setdefault('name', client_config['client'])
+        if client_config['name'] in names:
+            raise ValueError(f'Клиент {client_config["name"]} указан несколько раз')
+        names.add(client_config['name'])
+    return clients
+
+
+def ingest_client(client_config, db_settings, fetch_options, load_options, use_cache=True):
+    """
+    Загрузка данных одного клиента в отдельном процессе: собственные пул
+    соединений с базой данных, сеанс API и кэш ответов.
+    Возвращает итоги загрузки и метрики процесса. Ошибка загрузки
+    не прерывает загрузку остальных клиентов и возвращается в итогах.
+    """
+    import simulative
+
+    metrics.reset()
+    name = client_config['name']
+    result = {'name': name, 'inserted': 0, 'failed': 0, 'error': None}
+    db_pool = db.DatabasePool(**db_settings)
+    session = rs.create_session(fetch_options.get('max_workers', 4))
+    cache = None
+    if use_cache:
+        from api_cache import ResponseCache
+        cache = ResponseCache()
+    started = perf_counter()
+    try:
+        students_grade = db.StudentDAO(db_pool, client_config.get('db_name', DEFAULT_DB_NAME))
+        client_fetch_options = {**fetch_options, 'cache': cache, 'session': session}
+        with metrics.timer('stage', stage='client'):
+            if client_config.get('start') and client_config.get('end'):
+                fetching_data = rs.iter_students_data(
+                    client_config['client'], client_config['client_key'],
+                    client_config['start'], simulative.load_end(client_config['end']),
+                    **client_fetch_options)
+                inserted, failed, _ = simulative.load_students_data(
+                    students_grade, fetching_data, **load_options)
+            else:
+                inserted, failed = simulative.sync_students_data(
+                    students_grade, client_config['client'], client_config['client_key'],
+                    client_fetch_options, load_options,
+                    start_date=client_config.get('start'), interactive=False)
+        result['inserted'] = inserted
+        result['failed'] = failed
+    except Exception as e:
+        logger.error(f'Ошибка загрузки клиента {name}: {repr(e)}')
+        result['error'] = repr(e)
+    finally:
+        session.close()
+        db_pool.disconnect()
+    result['seconds'] = round(perf_counter() - started, 3)
+    result['records_per_second'] = (
+        round(result['inserted'] / result['seconds']) if result['seconds'] else None)
+    result['metrics'] = metrics.snapshot()
+    return result
+
+
+def create_partitions(clients, db_settings):
+    """
+    Создание месячных секций за периоды всех клиентов до запуска процессов,
+    чтобы процессы не создавали одни и те же секции одновременно.
+    Для клиентов без end секции создаются по текущий месяц.
+    """
+    periods = dict()
+    today = date.today().isoformat()
+    for client_config in clients:
+        if not client_config.get('start'):
+            continue
+        db_name = client_config.get('db_name', DEFAULT_DB_NAME)
+        start_date = client_config['start'][:10]
+        end_date = (client_config.get('end') or today)[:10]
+        if db_name in periods:
+            start_date = min(start_date, periods[db_name][0])
+            end_date = max(end_date, periods[db_name][1])
+        periods[db_name] = (start_date, end_date)
+    if not periods:
+        return
+    db_pool = db.DatabasePool(**db_settings)
+    try:
+        for db_name, (start_date, end_date) in periods.items():
+            db.SimulativeDB(db_pool, db_name).create_partitions(start_date, end_date)
+    finally:
+        db_pool.disconnect()
+
+
+def ingest_clients(clients, db_settings, fetch_options, load_options,
+                   processes=None, use_cache=True):
+    """
+    Параллельная загрузка данных нескольких клиентов в пуле процессов,
+    по одному процессу на клиента одновременно. Получение, разбор записей
+    (format_for_db) и запись в базу каждого клиента выполняются в своём
+    процессе, поэтому разбор использует несколько ядер. Метрики процессов
+    добавляются к метрикам запуска с меткой client.
+    Возвращает итоги загрузки по клиентам.
+    """
+    create_partitions(clients, db_settings)
+    processes = min(processes or os.cpu_count(), len(clients))
+    results = list()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(ingest_client, client_config, db_settings,
+                            fetch_options, load_options, use_cache)
+            for client_config in clients
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            metrics.merge(result.pop('metrics'), client=result['name'])
+            metrics.increment('client_errors', int(bool(result['error'])),
+                              client=result['name'])
+            if result['error']:
+                logger.error(f'Клиент {result["name"]}: ошибка {result["error"]}')
+            else:
+                logger.info(f'Клиент {result["name"]}: добавлено {result["inserted"]} '
+                            f'записей, ошибок записи {result["failed"]}, '
+                            f'{result["seconds"]} с ({result["records_per_second"]} записей/с)')
+            results.append(result)
+    return sorted(results, key=lambda result: result['name'])
@@ -1,243 +1,1122 @@
+import gzip
 import logging
 import psycopg2
 import argparse
+import threading
+import metrics
 
 from psycopg2 import sql
-from dotenv import load_dotenv
+from psycopg2.extensions import STATUS_READY
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from contextlib import contextmanager
 from os import environ
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from collections import Counter, OrderedDict
+from io import StringIO
+from itertools import islice
+from time import perf_counter
 
 
 logger = logging.getLogger('db_operations')
 
+CREATE_ATTEMPT_TYPE_QUERY = """
+    DO $$ BEGIN
+        CREATE TYPE attempt_type AS ENUM ('run', 'submit');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """
 
-class DatabaseConnection:
-    __instance = None
+CREATE_LOOKUP_QUERIES = (
+    """
+    CREATE TABLE IF NOT EXISTS lti_consumers (
+        id SERIAL PRIMARY KEY,
+        oauth_consumer_key VARCHAR(255) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lti_outcome_services (
+        id SERIAL PRIMARY KEY,
+        lis_outcome_service_url VARCHAR(255) NOT NULL UNIQUE
+    )
+    """,
+)
 
-    @staticmethod
-    def get_instance():
-        if not DatabaseConnection.__instance:
-            DatabaseConnection()
-        return DatabaseConnection.__instance
+CREATE_STUDENTS_GRADE_QUERY = """
+    CREATE TABLE IF NOT EXISTS students_grade (
+        id SERIAL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        oauth_consumer_id INTEGER REFERENCES lti_consumers (id),
+        lis_outcome_service_id INTEGER REFERENCES lti_outcome_services (id),
+        is_correct INTEGER,
+        attempt_type attempt_type,
+        user_id VARCHAR(100),
+        lis_result_sourcedid VARCHAR(255),
+        PRIMARY KEY (id, created_at),
+        CONSTRAINT students_grade_natural_key
+            UNIQUE (user_id, lis_result_sourcedid, created_at, attempt_type)
+    ) PARTITION BY RANGE (created_at)
+    """
 
-    def __init__(self, user, password, host, port, database=None):
-        if DatabaseConnection.__instance:
-            raise Exception("Этот класс является Singleton.")
-        else:
-            self.database = database
-            self.host = host
-            self.port = port
-            self.user = user
-            self.password = password
-            self.connection = None
-            DatabaseConnection.__instance = self
+CREATE_STAGING_QUERY = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS students_grade_staging (
+        user_id VARCHAR(100),
+        oauth_consumer_id INTEGER,
+        lis_result_sourcedid VARCHAR(255),
+        lis_outcome_service_id INTEGER,
+        is_correct INTEGER,
+        attempt_type attempt_type,
+        created_at TIMESTAMP
+    )
+    """
+
+CREATE_SYNC_STATE_QUERY = """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        client VARCHAR(100) PRIMARY KEY,
+        last_created_at TIMESTAMP NOT NULL
+    )
+    """
+
+CREATE_DAILY_STATS_QUERIES = (
+    """
+    CREATE TABLE IF NOT EXISTS students_daily_stats (
+        day DATE PRIMARY KEY,
+        unique_users BIGINT NOT NULL DEFAULT 0,
+        attempts BIGINT NOT NULL DEFAULT 0,
+        submits BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS students_daily_users (
+        day DATE,
+        user_id VARCHAR(100),
+        PRIMARY KEY (day, user_id)
+    )
+    """,
+)
+
+# Номер запроса fetch_students_data -> показатель дневной сводки
+DAILY_STATS_COLUMNS = {
+    1: 'unique_users',
+    2: 'attempts',
+    3: 'submits',
+}
+
+STUDENTS_GRADE_INDEXES = {
+    'students_grade_created_at_brin':
+        'ON students_grade USING brin (created_at)',
+    'students_grade_created_at_type_user_idx':
+        'ON students_grade (created_at, attempt_type, user_id)',
+}
+
+STORED_COLUMNS = (
+    'user_id',
+    'oauth_consumer_id',
+    'lis_result_sourcedid',
+    'lis_outcome_service_id',
+    'is_correct',
+    'attempt_type',
+    'created_at',
+)
+
+# Справочники повторяющихся значений: поле записи -> (таблица, колонка)
+LOOKUP_TABLES = {
+    'oauth_consumer_key': ('lti_consumers', 'oauth_consumer_key'),
+    'lis_outcome_service_url': ('lti_outcome_services', 'lis_outcome_service_url'),
+}
+
+# Внешние ключи students_grade на справочники: ограничение -> (колонка, таблица)
+LOOKUP_FOREIGN_KEYS = {
+    'students_grade_oauth_consumer_id_fkey': ('oauth_consumer_id', 'lti_consumers'),
+    'students_grade_lis_outcome_service_id_fkey': ('lis_outcome_service_id',
+                                                   'lti_outcome_services'),
+}
+
+EXPORT_QUERY = """
+    SELECT grade.user_id,
+           consumers.oauth_consumer_key,
+           grade.lis_result_sourcedid,
+           services.lis_outcome_service_url,
+           grade.is_correct,
+           grade.attempt_type::text,
+           grade.created_at
+    FROM students_grade AS grade
+    LEFT JOIN lti_consumers AS consumers ON consumers.id = grade.oauth_consumer_id
+    LEFT JOIN lti_outcome_services AS services ON services.id = grade.lis_outcome_service_id
+    WHERE {conditions}
+    """
+
+ATTEMPTS_QUERY = """
+    SELECT grade.user_id,
+           grade.lis_result_sourcedid,
+           grade.attempt_type::text,
+           grade.is_correct,
+           grade.created_at
+    FROM students_grade AS grade
+    WHERE {conditions}
+    """
+
+MIGRATE_LEGACY_QUERY = f"""
+    INSERT INTO students_grade (id, {", ".join(STORED_COLUMNS)})
+    SELECT legacy.id,
+           legacy.user_id,
+           consumers.id,
+           legacy.lis_result_sourcedid,
+           services.id,
+           legacy.is_correct,
+           legacy.attempt_type::text::attempt_type,
+           legacy.created_at
+    FROM students_grade_legacy AS legacy
+    LEFT JOIN lti_consumers AS consumers
+        ON consumers.oauth_consumer_key = legacy.oauth_consumer_key
+    LEFT JOIN lti_outcome_services AS services
+        ON services.lis_outcome_service_url = legacy.lis_outcome_service_url
+    ON CONFLICT DO NOTHING
+    """
+
+PARTITIONS_QUERY = """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+    JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+    WHERE parent.relname = %s
+    ORDER BY child.relname
+    """
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def partition_name(moment):
+    return f'students_grade_p{moment:%Y%m}'
+
+
+def create_partition(cursor, moment):
+    """
+    Создание месячной секции students_grade, содержащей момент moment
+    """
+    start = month_start(moment)
+    end = month_start(start + timedelta(days=32))
+    cursor.execute(
+        sql.SQL('''CREATE TABLE IF NOT EXISTS {}
+                   PARTITION OF students_grade
+                   FOR VALUES FROM (%s) TO (%s)''').format(
+            sql.Identifier(partition_name(start))),
+        (start, end)
+    )
+    return partition_name(start)
+
+
+def create_indexes(cursor):
+    for index_name, index_definition in STUDENTS_GRADE_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} {index_definition}')
+
+
+def is_alive(connection):
+    """
+    Проверка соединения перед выдачей из пула
+    """
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def batched(iterable, batch_size):
+    """
+    Разбиение последовательности записей на пачки по batch_size элементов
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
 
-    def connect(self):
+
+def is_completed_day(day):
+    """
+    День day (дата или строка YYYY-MM-DD) закончился по UTC
+    """
+    return datetime.fromisoformat(str(day)[:10]).date() < datetime.now(timezone.utc).date()
+
+
+def export_conditions(start_date=None, end_date=None, attempt_type=None):
+    """
+    Условия выгрузки за период [start_date, end_date] и по типу попытки
+    """
+    conditions = list()
+    params = dict()
+    if start_date:
+        conditions.append('grade.created_at >= %(start_date)s::date')
+        params['start_date'] = start_date
+    if end_date:
+        conditions.append('grade.created_at < %(end_date)s::date + 1')
+        params['end_date'] = end_date
+    if attempt_type:
+        conditions.append('grade.attempt_type = %(attempt_type)s')
+        params['attempt_type'] = attempt_type
+    return ' AND '.join(conditions) or 'TRUE', params
+
+
+def copy_value(value):
+    """
+    Преобразование значения в текстовый формат COPY
+    """
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def create_lookups(cursor):
+    cursor.execute(CREATE_ATTEMPT_TYPE_QUERY)
+    for create_query in CREATE_LOOKUP_QUERIES:
+        cursor.execute(create_query)
+
+
+def add_attempt_types(cursor, attempt_types):
+    """
+    Добавление значений в перечисление attempt_type. Новые значения
+    можно использовать только после фиксации транзакции.
+    """
+    for attempt_type in attempt_types:
+        cursor.execute(
+            sql.SQL('ALTER TYPE attempt_type ADD VALUE IF NOT EXISTS {}').format(
+                sql.Literal(attempt_type)))
+
+
+class LookupCache:
+    """
+    LRU-кэш идентификаторов значений справочника: не больше maxsize
+    значений, давно не использованные значения вытесняются первыми
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.__ids = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_many(self, values):
         """
-        Установка соединения с базой данных
+        Идентификаторы найденных значений и множество отсутствующих в кэше
         """
-        if self.connection is None or self.connection.closed:
-            try:
-                self.connection = psycopg2.connect(
-                    host=self.host,
-                    port=self.port,
-                    database=self.database,
-                    user=self.user,
-                    password=self.password
-                )
-                # Включаем autocommit для операций DDL
-                # self.connection.autocommit = True
-                logger.info('Соединение установлено.')
-            except psycopg2.ConnectionError as e:
-                logger.error(f"Ошибка подключения: {repr(e)}")
-                raise
-        return self.connection
+        found = dict()
+        missing = set()
+        with self.__lock:
+            for value in values:
+                if value in self.__ids:
+                    self.__ids.move_to_end(value)
+                    found[value] = self.__ids[value]
+                else:
+                    missing.add(value)
+        metrics.increment('lookup_cache_hits', len(found))
+        metrics.increment('lookup_cache_misses', len(missing))
+        return found, missing
 
-    def disconnect(self):
+    def put_many(self, ids):
+        with self.__lock:
+            self.__ids.update(ids)
+            for value in ids:
+                self.__ids.move_to_end(value)
+            while len(self.__ids) > self.maxsize:
+                self.__ids.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__ids.clear()
+
+
+class DatabasePool:
+    """
+    Пулы соединений с базами данных: отдельный пул для каждой базы
+    (служебная postgres и рабочая simulative). Соединения выдаются
+    через контекстный менеджер и проверяются перед выдачей.
+    Если все maxconn соединений базы заняты, выдача ждёт освобождения
+    соединения не дольше timeout секунд. Каждая запись в базу
+    (insert_students_data) занимает одно соединение, поэтому maxconn должен
+    быть больше количества потоков записи.
+    """
+
+    def __init__(self, user, password, host, port, minconn=1, maxconn=10, timeout=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.__pools = dict()
+        self.__slots = dict()
+        self.__lock = threading.Lock()
+
+    def get_pool(self, database):
+        with self.__lock:
+            if database not in self.__pools:
+                try:
+                    self.__pools[database] = ThreadedConnectionPool(
+                        self.minconn,
+                        self.maxconn,
+                        host=self.host,
+                        port=self.port,
+                        database=database,
+                        user=self.user,
+                        password=self.password
+                    )
+                    self.__slots[database] = threading.BoundedSemaphore(self.maxconn)
+                    logger.info(f'Пул соединений с базой данных {database} создан.')
+                except psycopg2.OperationalError as e:
+                    logger.error(f"Ошибка подключения: {repr(e)}")
+                    raise
+            return self.__pools[database]
+
+    @contextmanager
+    def connection(self, database, autocommit=False):
         """
-        Закрытие соединения
+        Получение соединения из пула базы данных database.
+        Закрытое или неотвечающее соединение заменяется новым.
         """
-        if self.connection and not self.connection.closed:
-            self.connection.close()
-            logger.info("Соединение закрыто")
-            self.connection = None
-
-    def get_connection(self):
-        return self.connection
+        pool = self.get_pool(database)
+        slots = self.__slots[database]
+        if not slots.acquire(timeout=self.timeout):
+            raise PoolError(f'Нет свободного соединения с базой данных {database} '
+                            f'за {self.timeout} с (maxconn={self.maxconn})')
+        try:
+            connection = pool.getconn()
+            if not is_alive(connection):
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+            connection.autocommit = autocommit
+            try:
+                yield connection
+            finally:
+                if not connection.closed:
+                    if connection.status != STATUS_READY:
+                        connection.rollback()
+                    connection.autocommit = False
+                pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            slots.release()
 
-    def __del__(self):
+    def disconnect(self):
         """
-        Деструктор для автоматического закрытия соединения
+        Закрытие всех соединений
         """
-        self.disconnect()
+        with self.__lock:
+            for pool in self.__pools.values():
+                pool.closeall()
+            self.__pools.clear()
+            self.__slots.clear()
+        logger.info("Соединения закрыты")
 
 
 class SimulativeDB:
-    def __init__(self, db_connection, db_name) -> None:
-        self.__db_connection = db_connection
+    def __init__(self, db_pool, db_name) -> None:
+        self.__db_pool = db_pool
         self.db_name = db_name
-        self.__db_connection.connect()
 
     def create_database(self):
         """
         Функция для создания базы данных PostgreSQL
         """
-        # Включение автокоммита
-        connection = self.__db_connection.get_connection()
-        connection.autocommit = True
-        # Курсор для выполнения операций с базой данных
-        try:
-            cursor = connection.cursor()
-            # Проверка существования базы данных
-            cursor.execute(
-                "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (self.db_name,))
-            exists = cursor.fetchone()
-
-            if not exists:
-                # Создание базы данных
-                sql_create_database = f'create database {self.db_name}'
-                cursor.execute(sql_create_database)
-                logger.info(f"База данных '{self.db_name}' успешно создана.")
-            else:
-                logger.info(f"База данных '{self.db_name}' уже существует.")
-        except psycopg2.Error as e:
-            logger.error(f"Ошибка подключения: {repr(e)}")
-        finally:
-            if cursor:
-                cursor.close()
+        with self.__db_pool.connection('postgres', autocommit=True) as connection:
+            # Курсор для выполнения операций с базой данных
+            try:
+                cursor = connection.cursor()
+                # Проверка существования базы данных
+                cursor.execute(
+                    "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (self.db_name,))
+                exists = cursor.fetchone()
+
+                if not exists:
+                    # Создание базы данных
+                    sql_create_database = f'create database {self.db_name}'
+                    cursor.execute(sql_create_database)
+                    logger.info(f"База данных '{self.db_name}' успешно создана.")
+                else:
+                    logger.info(f"База данных '{self.db_name}' уже существует.")
+            except psycopg2.Error as e:
+                logger.error(f"Ошибка подключения: {repr(e)}")
+            finally:
+                if cursor:
+                    cursor.close()
 
     def drop_database(self):
-        self.__db_connection.database = 'postgres'
-        connection = self.__db_connection.get_connection()
-        connection.autocommit = True
-        try:
-            cursor = connection.cursor()
-            cursor.execute(
-                "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (self.db_name,))
-            exists = cursor.fetchone()
-            if exists:
-                drop_query = sql.SQL("DROP DATABASE {}").format(
-                    sql.Identifier(self.db_name)
-                )
-                cursor.execute(drop_query)
-                logger.info(f"База данных '{self.db_name}' успешно удалена.")
-            else:
-                logger.info(f"База данных '{self.db_name}' не существует.")
-        except psycopg2.Error as e:
-            logger.error(f"Ошибка при удалении базы данных: {repr(e)}")
-        finally:
-            if cursor:
-                cursor.close()
+        with self.__db_pool.connection('postgres', autocommit=True) as connection:
+            try:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (self.db_name,))
+                exists = cursor.fetchone()
+                if exists:
+                    drop_query = sql.SQL("DROP DATABASE {}").format(
+                        sql.Identifier(self.db_name)
+                    )
+                    cursor.execute(drop_query)
+                    logger.info(f"База данных '{self.db_name}' успешно удалена.")
+                else:
+                    logger.info(f"База данных '{self.db_name}' не существует.")
+            except psycopg2.Error as e:
+                logger.error(f"Ошибка при удалении базы данных: {repr(e)}")
+            finally:
+                if cursor:
+                    cursor.close()
 
     def create_table(self):
-        self.__db_connection.database = self.db_name
-        connection = self.__db_connection.connect()
-        if connection is None:
-            raise ConnectionError(
-                "Не удалось получить соединение с базой данных.")
-        try:
-            with connection.cursor() as cursor:
-                create_table_query = """
-                    CREATE TABLE IF NOT EXISTS students_grade (
-                        id SERIAL PRIMARY KEY,
-                        user_id VARCHAR(100),
-                        oauth_consumer_key VARCHAR(255),
-                        lis_result_sourcedid VARCHAR(255),
-                        lis_outcome_service_url VARCHAR(255),
-                        is_correct INTEGER,
-                        attempt_type VARCHAR(25),
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                    """
-                cursor.execute(create_table_query)
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    create_lookups(cursor)
+                    cursor.execute(CREATE_STUDENTS_GRADE_QUERY)
+                    for create_query in CREATE_DAILY_STATS_QUERIES:
+                        cursor.execute(create_query)
+                    cursor.execute(CREATE_SYNC_STATE_QUERY)
+                    connection.commit()
+                logger.info('Таблица students_grade создана.')
+            except psycopg2.Error as e:
+                if connection:
+                    connection.rollback()
+                logger.error(
+                    f'Ошибка при создании таблицы students_grade: {repr(e)}.')
+                return
+            self.create_indexes()
+
+    def create_indexes(self):
+        """
+        Создание индексов по created_at: BRIN для диапазонных выборок и
+        составного индекса (created_at, attempt_type, user_id) для подсчётов
+        только по индексу. Индексы секционированной таблицы создаются
+        и в каждой её секции.
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    create_indexes(cursor)
+                    connection.commit()
+                logger.info('Индексы students_grade созданы.')
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(
+                    f'Ошибка при создании индексов students_grade: {repr(e)}.')
+
+    def create_partitions(self, start_date, end_date):
+        """
+        Создание месячных секций students_grade за период
+        [start_date, end_date] до начала параллельной загрузки
+        """
+        month = month_start(datetime.fromisoformat(str(start_date)))
+        last_month = month_start(datetime.fromisoformat(str(end_date)))
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    while month <= last_month:
+                        create_partition(cursor, month)
+                        month = month_start(month + timedelta(days=32))
                 connection.commit()
-            logger.info('Таблица students_grade создана.')
-        except psycopg2.Error as e:
-            if connection:
+                logger.info(f'Секции students_grade за период {start_date} - {end_date} созданы.')
+            except psycopg2.Error as e:
                 connection.rollback()
-            logger.error(
-                f'Ошибка при создании таблицы students_grade: {repr(e)}.')
+                logger.error(f'Ошибка при создании секций students_grade: {repr(e)}.')
+                raise
 
-    def drop_table(self):
-        self.__db_connection.database = self.db_name
-        connection = self.__db_connection.connect()
-        try:
-            with connection.cursor() as cursor:
-                drop_table_query = 'DROP TABLE IF EXISTS students_grade'
-                cursor.execute(drop_table_query)
+    def migrate_table(self):
+        """
+        Перестроение таблицы students_grade старого формата (несекционированной
+        или хранящей ключ потребителя и адрес сервиса строками) в таблицу,
+        секционированную по месяцам created_at, со справочниками lti_consumers
+        и lti_outcome_services. Данные переписываются в новую таблицу,
+        поэтому таблица и её индексы уменьшаются без VACUUM FULL.
+        """
+        with self.__db_pool.connection(self.db_name, autocommit=True) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('''
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'students_grade'
+                          AND column_name = 'oauth_consumer_key'
+                    ''')
+                    if not cursor.fetchone():
+                        logger.info('Таблица students_grade уже в новом формате.')
+                        return
+                    create_lookups(cursor)
+                    cursor.execute('''SELECT DISTINCT attempt_type FROM students_grade
+                                      WHERE attempt_type IS NOT NULL''')
+                    add_attempt_types(cursor, [attempt_type for (attempt_type,) in cursor])
+            except psycopg2.Error as e:
+                logger.error(f'Ошибка при подготовке справочников: {repr(e)}.')
+                raise
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'ALTER TABLE students_grade RENAME TO students_grade_legacy')
+                    cursor.execute(
+                        'ALTER TABLE students_grade_legacy ALTER COLUMN id DROP DEFAULT')
+                    cursor.execute('DROP SEQUENCE IF EXISTS students_grade_id_seq CASCADE')
+                    for constraint in ('students_grade_pkey', 'students_grade_natural_key'):
+                        cursor.execute(f'ALTER TABLE students_grade_legacy '
+                                       f'DROP CONSTRAINT IF EXISTS {constraint}')
+                    for index_name in STUDENTS_GRADE_INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+                    cursor.execute(PARTITIONS_QUERY, ('students_grade_legacy',))
+                    for (partition,) in cursor.fetchall():
+                        cursor.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(
+                            sql.Identifier(partition),
+                            sql.Identifier(partition.replace(
+                                'students_grade_', 'students_grade_legacy_', 1))))
+                    cursor.execute(CREATE_STUDENTS_GRADE_QUERY)
+                    create_indexes(cursor)
+                    cursor.execute(
+                        'SELECT DISTINCT date_trunc(\'month\', created_at) FROM students_grade_legacy')
+                    for (month,) in cursor.fetchall():
+                        create_partition(cursor, month)
+                    for field, (table, column) in LOOKUP_TABLES.items():
+                        cursor.execute(f'''
+                            INSERT INTO {table} ({column})
+                            SELECT DISTINCT {field} FROM students_grade_legacy
+                            WHERE {field} IS NOT NULL
+                            ON CONFLICT DO NOTHING
+                        ''')
+                    cursor.execute(MIGRATE_LEGACY_QUERY)
+                    cursor.execute('''
+                        SELECT setval(pg_get_serial_sequence('students_grade', 'id'),
+                                      coalesce(max(id), 0) + 1, false)
+                        FROM students_grade
+                    ''')
+                    cursor.execute('DROP TABLE students_grade_legacy')
                 connection.commit()
-            logger.info('Таблица students_grade удалена.')
-        except psycopg2.Error as e:
-            if connection:
+                logger.info('Таблица students_grade перестроена: секции по месяцам, '
+                            'справочники lti_consumers и lti_outcome_services.')
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(
+                    f'Ошибка при перестроении таблицы students_grade: {repr(e)}.')
+                raise
+
+    def drop_partitions(self, keep_months, detach_only=False):
+        """
+        Удаление (или отсоединение при detach_only=True) секций
+        students_grade старше keep_months месяцев от текущего
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            cutoff = month_start(datetime.now())
+            for _ in range(keep_months - 1):
+                cutoff = month_start(cutoff - timedelta(days=1))
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(PARTITIONS_QUERY, ('students_grade',))
+                    partitions = [partition for (partition,) in cursor.fetchall()
+                                  if partition < partition_name(cutoff)]
+                    for partition in partitions:
+                        cursor.execute(
+                            sql.SQL('ALTER TABLE students_grade DETACH PARTITION {}').format(
+                                sql.Identifier(partition)))
+                        if not detach_only:
+                            cursor.execute(
+                                sql.SQL('DROP TABLE {}').format(sql.Identifier(partition)))
+                        logger.info(f'Секция {partition} '
+                                    f'{"отсоединена" if detach_only else "удалена"}.')
+                connection.commit()
+                return partitions
+            except psycopg2.Error as e:
                 connection.rollback()
-            logger.error(
-                f'Ошибка при удалении таблицы students_grade: {repr(e)}.')
+                logger.error(f'Ошибка при удалении секций students_grade: {repr(e)}.')
+
+    def rebuild_daily_stats(self, start_date=None, end_date=None):
+        """
+        Пересчёт дневной сводки students_daily_stats по таблице students_grade
+        за период [start_date, end_date] или за всё время
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            day_filter = sql.SQL('TRUE')
+            grade_filter = sql.SQL('TRUE')
+            if start_date:
+                day_filter = sql.SQL('day >= %(start_date)s::date')
+                grade_filter = sql.SQL('created_at >= %(start_date)s::date')
+            if end_date:
+                day_filter = sql.SQL('{} AND day <= %(end_date)s::date').format(day_filter)
+                grade_filter = sql.SQL(
+                    '{} AND created_at < %(end_date)s::date + 1').format(grade_filter)
+            params = {'start_date': start_date, 'end_date': end_date}
+            try:
+                with connection.cursor() as cursor:
+                    for create_query in CREATE_DAILY_STATS_QUERIES:
+                        cursor.execute(create_query)
+                    cursor.execute(sql.SQL(
+                        'DELETE FROM students_daily_users WHERE {}').format(day_filter), params)
+                    cursor.execute(sql.SQL(
+                        'DELETE FROM students_daily_stats WHERE {}').format(day_filter), params)
+                    cursor.execute(sql.SQL('''
+                        INSERT INTO students_daily_users (day, user_id)
+                        SELECT DISTINCT created_at::date, user_id
+                        FROM students_grade
+                        WHERE {}
+                    ''').format(grade_filter), params)
+                    cursor.execute(sql.SQL('''
+                        INSERT INTO students_daily_stats (day, unique_users, attempts, submits)
+                        SELECT created_at::date,
+                               count(DISTINCT user_id),
+                               count(*),
+                               count(*) FILTER (WHERE attempt_type = 'submit')
+                        FROM students_grade
+                        WHERE {}
+                        GROUP BY 1
+                    ''').format(grade_filter), params)
+                connection.commit()
+                logger.info('Дневная сводка students_daily_stats пересчитана.')
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(
+                    f'Ошибка при пересчёте дневной сводки: {repr(e)}.')
+
+    def enable_sync(self):
+        """
+        Подготовка существующей таблицы к инкрементальной синхронизации:
+        удаление повторяющихся записей, создание естественного ключа
+        и таблицы отметок синхронизации
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(CREATE_SYNC_STATE_QUERY)
+                    cursor.execute(
+                        "SELECT 1 FROM pg_constraint WHERE conname = 'students_grade_natural_key'")
+                    if not cursor.fetchone():
+                        cursor.execute('''
+                            DELETE FROM students_grade AS duplicate
+                            USING students_grade AS original
+                            WHERE duplicate.id > original.id
+                              AND duplicate.user_id = original.user_id
+                              AND duplicate.lis_result_sourcedid = original.lis_result_sourcedid
+                              AND duplicate.created_at = original.created_at
+                              AND duplicate.attempt_type = original.attempt_type
+                        ''')
+                        logger.info(f'Удалено повторяющихся записей: {cursor.rowcount}')
+                        cursor.execute('''
+                            ALTER TABLE students_grade
+                            ADD CONSTRAINT students_grade_natural_key
+                            UNIQUE (user_id, lis_result_sourcedid, created_at, attempt_type)
+                        ''')
+                connection.commit()
+                logger.info('Естественный ключ students_grade создан.')
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(
+                    f'Ошибка при создании естественного ключа students_grade: {repr(e)}.')
+                raise
+
+    def create_foreign_keys(self):
+        """
+        Создание недостающих внешних ключей students_grade на справочники
+        lti_consumers и lti_outcome_services в таблице, созданной без них
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    for constraint, (column, table) in LOOKUP_FOREIGN_KEYS.items():
+                        cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s',
+                                       (constraint,))
+                        if cursor.fetchone():
+                            continue
+                        cursor.execute(sql.SQL(
+                            'ALTER TABLE students_grade ADD CONSTRAINT {} '
+                            'FOREIGN KEY ({}) REFERENCES {} (id)').format(
+                                sql.Identifier(constraint), sql.Identifier(column),
+                                sql.Identifier(table)))
+                        logger.info(f'Внешний ключ {constraint} создан.')
+                connection.commit()
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(
+                    f'Ошибка при создании внешних ключей students_grade: {repr(e)}.')
+                raise
+
+    def upgrade(self):
+        """
+        Обновление существующей базы данных: секционирование таблицы
+        и справочники повторяющихся значений, естественный ключ, создание недостающих индексов, построение
+        дневной сводки и обновление статистики
+        """
+        self.migrate_table()
+        self.create_foreign_keys()
+        self.enable_sync()
+        self.create_indexes()
+        self.rebuild_daily_stats()
+        with self.__db_pool.connection(self.db_name, autocommit=True) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM ANALYZE students_grade')
+                logger.info('База данных обновлена.')
+            except psycopg2.Error as e:
+                logger.error(f'Ошибка при обновлении базы данных: {repr(e)}.')
+
+    def drop_table(self):
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    drop_table_query = '''DROP TABLE IF EXISTS students_grade,
+                                                       students_daily_stats,
+                                                       students_daily_users,
+                                                       sync_state,
+                                                       lti_consumers,
+                                                       lti_outcome_services'''
+                    cursor.execute(drop_table_query)
+                    cursor.execute('DROP TYPE IF EXISTS attempt_type')
+                    connection.commit()
+                logger.info('Таблица students_grade удалена.')
+            except psycopg2.Error as e:
+                if connection:
+                    connection.rollback()
+                logger.error(
+                    f'Ошибка при удалении таблицы students_grade: {repr(e)}.')
 
 
 class StudentDAO:
-    def __init__(self, db_connection) -> None:
-        self.__db_connection = db_connection
-        self.__db_connection.connect()
+    def __init__(self, db_pool, db_name='simulative', lookup_cache_size=10000) -> None:
+        self.__db_pool = db_pool
+        self.db_name = db_name
+        self.__partitions = set()
+        self.__lookups = {field: LookupCache(lookup_cache_size) for field in LOOKUP_TABLES}
+        self.__attempt_types = set()
+
+    def insert_students_data(self, students_data, batch_size=1000,
+                             commit_every=10000, method='copy'):
+        """
+        Пакетная загрузка записей StudentRecord в таблицу students_grade.
+        Записи передаются пачками по batch_size строк через COPY FROM STDIN
+        во временную таблицу (method='copy') или execute_values
+        (method='values'). Записи, уже существующие в таблице по естественному
+        ключу, пропускаются. Ключ потребителя и адрес сервиса заменяются
+        идентификаторами справочников через LRU-кэш. Фиксация транзакции выполняется каждые
+        commit_every строк и перед созданием новой месячной секции или
+        значений справочников, поэтому ошибка в одной пачке откатывает
+        только незафиксированные строки.
+        Возвращает количество добавленных записей и количество записей,
+        которые не удалось добавить.
+        """
+        insert_batch = self.__copy_batch if method == 'copy' else self.__values_batch
+        inserted = 0
+        duplicates = 0
+        failed = 0
+        pending = 0
+        pending_inserted = 0
+        started = perf_counter()
+        with self.__db_pool.connection(self.db_name) as connection:
+
+            def commit():
+                nonlocal inserted, duplicates, failed, pending, pending_inserted
+                if self.__commit(connection):
+                    inserted += pending_inserted
+                    duplicates += pending - pending_inserted
+                else:
+                    failed += pending
+                pending = pending_inserted = 0
 
-    def insert_students_data(self, students_data):
-        connection = self.__db_connection.get_connection()
-        try:
             with connection.cursor() as cursor:
-                for student_data in students_data:
-                    insert_student_data_query = '''
-                        INSERT INTO students_grade (user_id, 
-                            oauth_consumer_key,
-                            lis_result_sourcedid,
-                            lis_outcome_service_url,
-                            is_correct,
-                            attempt_type,
-                            created_at)
-                        VALUES (%(user_id)s,
-                            %(oauth_consumer_key)s,
-                            %(lis_result_sourcedid)s,
-                            %(lis_outcome_service_url)s,
-                            %(is_correct)s,
-                            %(attempt_type)s,
-                            %(created_at)s)
-                    '''
+                for batch in batched(students_data, batch_size):
+                    try:
+                        months = self.__missing_months(batch)
+                        ids, missing, attempt_types = self.__cached_ids(batch)
+                        if months or attempt_types or any(missing.values()):
+                            if pending:
+                                commit()
+                            if months:
+                                self.__create_partitions(connection, cursor, months)
+                            self.__add_lookups(connection, cursor, ids,
+                                               missing, attempt_types)
+                        rows = self.__encode_batch(batch, ids)
+                        with metrics.timer('insert_batch', method=method):
+                            inserted_rows = insert_batch(cursor, rows)
+                        if inserted_rows:
+                            self.__update_daily_stats(cursor, inserted_rows)
+                    except psycopg2.Error as e:
+                        connection.rollback()
+                        self.__forget_ids()
+                        failed += pending + len(batch)
+                        pending = pending_inserted = 0
+                        logger.error(f'Ошибка при записи данных в таблицу: {repr(e)}.')
+                        continue
+                    pending += len(batch)
+                    pending_inserted += len(inserted_rows)
+                    if pending >= commit_every:
+                        commit()
+                if pending:
+                    commit()
+            elapsed = perf_counter() - started
+            rate = (inserted + duplicates) / elapsed if elapsed else 0
+            logger.info(f"Успешно добавлено {inserted} записей за {elapsed:.2f} с "
+                        f"({rate:.0f} записей/с), пропущено повторов: {duplicates}.")
+            if failed:
+                logger.warning(f'Не удалось добавить {failed} записей.')
+            metrics.increment('rows_inserted', inserted)
+            metrics.increment('rows_duplicate', duplicates)
+            metrics.increment('rows_failed', failed)
+            return inserted, failed
+
+    def __missing_months(self, batch):
+        """
+        Месяцы записей пачки, секции которых ещё не созданы этим объектом
+        """
+        months = {month_start(student_data.created_at) for student_data in batch}
+        return sorted(month for month in months
+                      if partition_name(month) not in self.__partitions)
+
+    def __create_partitions(self, connection, cursor, months):
+        """
+        Создание месячных секций months в отдельной зафиксированной
+        транзакции. CREATE TABLE ... PARTITION OF блокирует всю таблицу
+        students_grade, поэтому вызывающий фиксирует свои строки до создания
+        секций: иначе две загрузки, одновременно дошедшие до нового месяца,
+        ждали бы друг друга.
+        """
+        partitions = [create_partition(cursor, month) for month in months]
+        connection.commit()
+        self.__partitions.update(partitions)
+
+    def __update_daily_stats(self, cursor, inserted_rows):
+        """
+        Инкрементальное обновление дневной сводки добавленными строками
+        (user_id, attempt_type, created_at). Новые пользователи дня
+        определяются по вставленным строкам students_daily_users.
+        Строки сводки изменяются в порядке дня и пользователя, чтобы
+        параллельные загрузки блокировали их в одном порядке и не попадали
+        во взаимную блокировку. Строка дня в students_daily_stats остаётся
+        заблокированной до фиксации, поэтому загрузки записей одного дня
+        выполняются по очереди.
+        """
+        daily_stats = dict()
+        daily_users = set()
+        for user_id, attempt_type, created_at in inserted_rows:
+            day = created_at.date()
+            attempts, submits = daily_stats.get(day, (0, 0))
+            daily_stats[day] = (attempts + 1, submits + (attempt_type == 'submit'))
+            daily_users.add((day, user_id))
+        new_users = execute_values(
+            cursor,
+            '''INSERT INTO students_daily_users (day, user_id) VALUES %s
+               ON CONFLICT DO NOTHING
+               RETURNING day''',
+            sorted(daily_users),
+            page_size=len(daily_users),
+            fetch=True
+        )
+        unique_users = Counter(day for (day,) in new_users)
+        execute_values(
+            cursor,
+            '''INSERT INTO students_daily_stats (day, unique_users, attempts, submits)
+               VALUES %s
+               ON CONFLICT (day) DO UPDATE SET
+                   unique_users = students_daily_stats.unique_users + EXCLUDED.unique_users,
+                   attempts = students_daily_stats.attempts + EXCLUDED.attempts,
+                   submits = students_daily_stats.submits + EXCLUDED.submits''',
+            [(day, unique_users[day], attempts, submits)
+             for day, (attempts, submits) in sorted(daily_stats.items())],
+            page_size=len(daily_stats)
+        )
+
+    def __commit(self, connection):
+        try:
+            connection.commit()
+            return True
+        except psycopg2.Error as e:
+            connection.rollback()
+            self.__forget_ids()
+            logger.error(f'Ошибка при записи данных в таблицу: {repr(e)}.')
+            return False
+
+    def __forget_ids(self):
+        """
+        Сброс известных секций и кэшей справочников после ошибки записи:
+        справочники могли быть очищены другим процессом (TRUNCATE ...
+        RESTART IDENTITY), и идентификаторы в кэше больше не действительны
+        """
+        self.__partitions.clear()
+        self.__attempt_types.clear()
+        for lookup in self.__lookups.values():
+            lookup.clear()
+
+    def __cached_ids(self, batch):
+        """
+        Идентификаторы значений справочников для записей пачки из кэша,
+        значения справочников, которых нет в кэше, и новые типы попыток
+        """
+        ids = dict()
+        missing = dict()
+        for field, lookup in self.__lookups.items():
+            values = {getattr(student_data, field) for student_data in batch}
+            values.discard(None)
+            ids[field], missing[field] = lookup.get_many(values)
+        attempt_types = {student_data.attempt_type for student_data in batch}
+        attempt_types -= self.__attempt_types | {None, 'run', 'submit'}
+        return ids, missing, attempt_types
+
+    def __add_lookups(self, connection, cursor, ids, missing, attempt_types):
+        """
+        Добавление значений missing в справочники одним запросом на
+        справочник и новых типов попыток в отдельной зафиксированной
+        транзакции того же соединения: вызывающий фиксирует свои строки
+        заранее. Идентификаторы попадают в кэш только после фиксации,
+        поэтому откат не оставляет в кэше несуществующих идентификаторов.
+        """
+        add_attempt_types(cursor, sorted(attempt_types))
+        for field, values in missing.items():
+            if values:
+                ids[field].update(self.__fetch_ids(cursor, field, values))
+        connection.commit()
+        self.__attempt_types |= attempt_types
+        for field, lookup in self.__lookups.items():
+            lookup.put_many({value: ids[field][value] for value in missing[field]})
+
+    def __fetch_ids(self, cursor, field, values):
+        table, column = LOOKUP_TABLES[field]
+        values = sorted(values)
+        execute_values(
+            cursor,
+            f'INSERT INTO {table} ({column}) VALUES %s ON CONFLICT DO NOTHING',
+            [(value,) for value in values],
+            page_size=len(values)
+        )
+        cursor.execute(f'SELECT {column}, id FROM {table} WHERE {column} = ANY(%s)', (values,))
+        return dict(cursor.fetchall())
+
+    def __encode_batch(self, batch, ids):
+        """
+        Строки пачки записей StudentRecord в порядке STORED_COLUMNS:
+        ключ потребителя и адрес сервиса заменяются идентификаторами
+        справочников, остальные поля передаются без изменений
+        """
+        consumer_ids = ids['oauth_consumer_key']
+        service_ids = ids['lis_outcome_service_url']
+        return [
+            (user_id, consumer_ids.get(consumer_key), sourcedid,
+             service_ids.get(service_url), is_correct, attempt_type, created_at)
+            for (user_id, consumer_key, sourcedid, service_url,
+                 is_correct, attempt_type, created_at) in batch
+        ]
+
+    def __copy_batch(self, cursor, rows):
+        buffer = StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        cursor.execute(CREATE_STAGING_QUERY)
+        cursor.copy_expert(
+            f'COPY students_grade_staging ({", ".join(STORED_COLUMNS)}) FROM STDIN',
+            buffer
+        )
+        cursor.execute(f'''
+            INSERT INTO students_grade ({", ".join(STORED_COLUMNS)})
+            SELECT {", ".join(STORED_COLUMNS)} FROM students_grade_staging
+            ON CONFLICT DO NOTHING
+            RETURNING user_id, attempt_type, created_at
+        ''')
+        inserted_rows = cursor.fetchall()
+        cursor.execute('TRUNCATE students_grade_staging')
+        return inserted_rows
+
+    def __values_batch(self, cursor, rows):
+        insert_students_data_query = f'''
+            INSERT INTO students_grade ({", ".join(STORED_COLUMNS)})
+            VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING user_id, attempt_type, created_at
+        '''
+        return execute_values(cursor, insert_students_data_query, rows,
+                              page_size=len(rows), fetch=True)
+
+    def get_watermark(self, client):
+        """
+        Время создания последней загруженной записи клиента
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
                     cursor.execute(
-                        insert_student_data_query, student_data
-                    )
+                        'SELECT last_created_at FROM sync_state WHERE client = %s', (client,))
+                    watermark = cursor.fetchone()
                 connection.commit()
-            logger.info(f"Успешно добавлено {len(students_data)} записей.")
-        except psycopg2.Error as e:
-            if connection:
+                return watermark[0] if watermark else None
+            except psycopg2.Error as e:
                 connection.rollback()
-            logger.error(f'Ошибка при записи данных в таблицу: {repr(e)}.')
+                logger.error(f'Ошибка при чтении отметки синхронизации: {repr(e)}.')
+                raise
 
-    def clear_students_data(self):
-        connection = self.__db_connection.get_connection()
-        try:
-            with connection.cursor() as cursor:
-                clear_query = 'TRUNCATE TABLE students_grade RESTART IDENTITY'
-                cursor.execute(clear_query)
+    def set_watermark(self, client, last_created_at):
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('''
+                        INSERT INTO sync_state (client, last_created_at)
+                        VALUES (%s, %s)
+                        ON CONFLICT (client) DO UPDATE SET
+                            last_created_at = GREATEST(sync_state.last_created_at,
+                                                       EXCLUDED.last_created_at)
+                    ''', (client, last_created_at))
                 connection.commit()
-            logger.info('Таблица students_grade очищена, счётчики сброшены.')
-        except psycopg2.Error as e:
-            if connection:
+                logger.info(f'Отметка синхронизации {client}: {last_created_at}')
+            except psycopg2.Error as e:
                 connection.rollback()
-            logger.error(f'Ошибка при удалении данных из таблицы: {repr(e)}.')
+                logger.error(f'Ошибка при записи отметки синхронизации: {repr(e)}.')
+                raise
+
+    def clear_students_data(self):
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    clear_query = '''TRUNCATE TABLE students_grade,
+                                                     students_daily_stats,
+                                                     students_daily_users,
+                                                     sync_state,
+                                                     lti_consumers,
+                                                     lti_outcome_services
+                                     RESTART IDENTITY'''
+                    cursor.execute(clear_query)
+                    connection.commit()
+                for lookup in self.__lookups.values():
+                    lookup.clear()
+                logger.info('Таблица students_grade очищена, счётчики сброшены.')
+            except psycopg2.Error as e:
+                if connection:
+                    connection.rollback()
+                logger.error(f'Ошибка при удалении данных из таблицы: {repr(e)}.')
 
-    def fetch_students_data(self, num_query=0, date=None):
-        connection = self.__db_connection.get_connection()
+    def fetch_students_data(self, num_query=0, date=None, cached=True):
+        """
+        Запрос num_query за день date. Показатели 1-3 (уникальные
+        пользователи, попытки, отправленные решения) закончившегося дня
+        берутся из дневной сводки students_daily_stats, которая обновляется
+        в той же транзакции, что и записи дня. Если дня нет в сводке или
+        cached=False, показатель считается по students_grade. Попадания
+        и промахи учитываются в метриках report_cache_hits и report_cache_misses.
+        """
+        if cached and date and num_query in DAILY_STATS_COLUMNS and is_completed_day(date):
+            raws = self.__fetch_daily_stat(DAILY_STATS_COLUMNS[num_query], date)
+            if raws:
+                return raws
         queries = {
             0:  '''SELECT * 
                    FROM students_grade                   
                    LIMIT 10''',
             1:  '''SELECT count(DISTINCT user_id) 
                    FROM students_grade 
-                   WHERE DATE(created_at) = %s''',
+                   WHERE created_at >= %(date)s::date
+                     AND created_at < %(date)s::date + 1''',
             2:  '''SELECT count(*) 
                    FROM students_grade 
-                   WHERE DATE(created_at) = %s''',
+                   WHERE created_at >= %(date)s::date
+                     AND created_at < %(date)s::date + 1''',
             3:  '''SELECT count(*) 
                    FROM students_grade 
-                   WHERE DATE(created_at) = %s and attempt_type = 'submit'
+                   WHERE created_at >= %(date)s::date
+                     AND created_at < %(date)s::date + 1
+                     AND attempt_type = 'submit'
                 ''',
         }
         fetch_query = queries[num_query]
@@ -246,20 +1125,169 @@ class StudentDAO:
             fetch_query = queries[0]
         else:
             logger.info(f'Выполняется запрос {fetch_query}')
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute(fetch_query, (date,))
-                raws = cursor.fetchall()
-            logger.info('Данные из таблицы извлечены')
-            if date:
-                return raws[0]
-            for raw in raws:
-                print(raw)
-        except psycopg2.Error as e:
-            if connection:
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    with metrics.timer('query', metric=f'query_{num_query if date else 0}'):
+                        cursor.execute(fetch_query, {'date': date})
+                    raws = cursor.fetchall()
+                logger.info('Данные из таблицы извлечены')
+                if date:
+                    return raws[0]
+                for raw in raws:
+                    print(raw)
+            except psycopg2.Error as e:
+                if connection:
+                    connection.rollback()
+                logger.error(
+                    f'Ошибка при извлечении данных из таблицы: {repr(e)}.')
+
+    def __fetch_daily_stat(self, column, date):
+        """
+        Показатель column за день date из дневной сводки или None,
+        если дня в сводке нет
+        """
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    with metrics.timer('query', metric=f'daily_stats_{column}'):
+                        cursor.execute(
+                            sql.SQL('SELECT {} FROM students_daily_stats WHERE day = %s').format(
+                                sql.Identifier(column)),
+                            (date,))
+                    raws = cursor.fetchone()
+                connection.rollback()
+            except psycopg2.Error as e:
                 connection.rollback()
-            logger.error(
-                f'Ошибка при извлечении данных из таблицы: {repr(e)}.')
+                logger.error(f'Ошибка при чтении дневной сводки: {repr(e)}.')
+                raws = None
+        if raws:
+            metrics.increment('report_cache_hits', metric=column)
+        else:
+            metrics.increment('report_cache_misses', metric=column)
+        return raws
+
+    def iter_attempts(self, start_date=None, end_date=None, chunk_size=100000):
+        """
+        Попытки (user_id, lis_result_sourcedid, attempt_type, is_correct,
+        created_at) за период [start_date, end_date] пачками по chunk_size
+        строк из именованного курсора на сервере
+        """
+        conditions, params = export_conditions(start_date, end_date)
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor(name='students_grade_attempts') as cursor:
+                    cursor.itersize = chunk_size
+                    with metrics.timer('query', metric='attempts'):
+                        cursor.execute(ATTEMPTS_QUERY.format(conditions=conditions), params)
+                    while rows := cursor.fetchmany(chunk_size):
+                        yield rows
+                connection.rollback()
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(f'Ошибка при чтении попыток: {repr(e)}.')
+                raise
+
+    def export_students_data(self, path, start_date=None, end_date=None,
+                             attempt_type=None, file_format='csv', chunk_size=100000):
+        """
+        Потоковая выгрузка students_grade за период [start_date, end_date]
+        и по типу попытки в файл path. CSV (сжатый gzip, если имя файла
+        оканчивается на .gz) пишется напрямую из COPY TO STDOUT, Parquet -
+        группами строк по chunk_size из именованного курсора на сервере,
+        поэтому в памяти находится не больше одной группы строк.
+        Возвращает количество выгруженных строк.
+        """
+        conditions, params = export_conditions(start_date, end_date, attempt_type)
+        export_query = EXPORT_QUERY.format(conditions=conditions)
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with metrics.timer('export', format=file_format):
+                    if file_format == 'parquet':
+                        rows_count = self.__export_parquet(
+                            connection, export_query, params, path, chunk_size)
+                    else:
+                        rows_count = self.__export_csv(
+                            connection, export_query, params, path)
+                connection.rollback()
+                metrics.increment('rows_exported', rows_count)
+                logger.info(f'В файл {path} выгружено {rows_count} строк')
+                return rows_count
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.error(f'Ошибка при выгрузке данных: {repr(e)}.')
+                raise
+
+    def __export_csv(self, connection, export_query, params, path):
+        with connection.cursor() as cursor:
+            copy_query = cursor.mogrify(export_query, params).decode()
+            opener = gzip.open if str(path).endswith('.gz') else open
+            with opener(path, 'wb') as export_file:
+                cursor.copy_expert(
+                    f'COPY ({copy_query}) TO STDOUT WITH (FORMAT csv, HEADER)', export_file)
+            return cursor.rowcount
+
+    def __export_parquet(self, connection, export_query, params, path, chunk_size):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Для выгрузки в Parquet установите pyarrow')
+        schema = pa.schema([
+            ('user_id', pa.string()),
+            ('oauth_consumer_key', pa.string()),
+            ('lis_result_sourcedid', pa.string()),
+            ('lis_outcome_service_url', pa.string()),
+            ('is_correct', pa.int32()),
+            ('attempt_type', pa.string()),
+            ('created_at', pa.timestamp('us')),
+        ])
+        rows_count = 0
+        with connection.cursor(name='students_grade_export') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(export_query, params)
+            with pq.ParquetWriter(path, schema) as writer:
+                while rows := cursor.fetchmany(chunk_size):
+                    columns = [list(column) for column in zip(*rows)]
+                    writer.write_batch(pa.record_batch(columns, schema=schema))
+                    rows_count += len(rows)
+        return rows_count
+
+    def fetch_daily_metrics(self, start_date, end_date):
+        """
+        Уникальные пользователи, попытки и отправленные решения за каждый
+        день периода [start_date, end_date] из дневной сводки students_daily_stats.
+        Дни, найденные в сводке, учитываются в report_cache_hits, дни без
+        данных (нули в отчёте) - в report_cache_misses.
+        """
+        metrics_query = '''
+            SELECT days.day::date,
+                   coalesce(stats.unique_users, 0),
+                   coalesce(stats.attempts, 0),
+                   coalesce(stats.submits, 0),
+                   stats.day IS NOT NULL
+            FROM generate_series(%(start_date)s::date, %(end_date)s::date,
+                                 interval '1 day') AS days(day)
+            LEFT JOIN students_daily_stats AS stats ON stats.day = days.day
+            ORDER BY days.day
+        '''
+        with self.__db_pool.connection(self.db_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    with metrics.timer('query', metric='daily_metrics'):
+                        cursor.execute(metrics_query,
+                                       {'start_date': start_date, 'end_date': end_date})
+                    raws = cursor.fetchall()
+                hits = sum(1 for *_, found in raws if found)
+                metrics.increment('report_cache_hits', hits, metric='daily_metrics')
+                metrics.increment('report_cache_misses', len(raws) - hits, metric='daily_metrics')
+                logger.info(f'Метрики за период {start_date} - {end_date} извлечены')
+                return [raw[:4] for raw in raws]
+            except psycopg2.Error as e:
+                if connection:
+                    connection.rollback()
+                logger.error(
+                    f'Ошибка при извлечении данных из таблицы: {repr(e)}.')
 
 
 def create_parser():
@@ -281,6 +1309,42 @@ def create_parser():
         help='Удаление объекта',
         required=False,
     )
+    parser.add_argument(
+        '-u',
+        '--upgrade',
+        help='Обновление существующей базы данных (индексы, статистика)',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--rebuild',
+        help='Пересчёт дневной сводки (за период --start - --end или за всё время)',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--start',
+        help='Начальная дата в формате YYYY-MM-DD',
+        required=False,
+    )
+    parser.add_argument(
+        '--end',
+        help='Конечная дата в формате YYYY-MM-DD',
+        required=False,
+    )
+    parser.add_argument(
+        '-r',
+        '--retention',
+        type=int,
+        help='Удаление секций старше указанного количества месяцев',
+        required=False,
+    )
+    parser.add_argument(
+        '--detach',
+        help='Отсоединять старые секции вместо удаления',
+        required=False,
+        action='store_true'
+    )
     parser.add_argument(
         '-f',
         '--fetch',
@@ -288,6 +1352,24 @@ def create_parser():
         required=False,
         action='store_true'
     )
+    parser.add_argument(
+        '-e',
+        '--export',
+        help='Выгрузка данных в файл CSV или Parquet (за период --start - --end)',
+        required=False,
+    )
+    parser.add_argument(
+        '--format',
+        choices=['csv', 'parquet'],
+        help='Формат выгрузки (по умолчанию определяется по расширению файла)',
+        required=False,
+    )
+    parser.add_argument(
+        '--attempt-type',
+        choices=['run', 'submit'],
+        help='Выгрузка только попыток указанного типа',
+        required=False,
+    )
     try:
         args = parser.parse_args()
         return args
@@ -311,6 +1393,8 @@ def setup_logging():
 
 
 def main():
+    from dotenv import load_dotenv
+
     setup_logging()
     logger = logging.getLogger('db_operations')
     load_dotenv()
@@ -320,22 +1404,13 @@ def main():
     port = int(environ['PORT'])
     db_name = 'simulative'
     args = create_parser()
-    db_connection = None
+    db_pool = DatabasePool(user=user,
+                           password=password,
+                           host=host,
+                           port=port)
     try:
-        if args.create or args.delete in ('database', 'table'):
-            db_connection = DatabaseConnection(user=user,
-                                               password=password,
-                                               host=host,
-                                               port=port,
-                                               )
-            simulative = SimulativeDB(db_connection, db_name)
-        elif args.delete == 'data' or args.fetch:
-            db_connection = DatabaseConnection(user=user,
-                                               password=password,
-                                               host=host,
-                                               port=port,
-                                               database=db_name)
-            students_grade = StudentDAO(db_connection)
+        simulative = SimulativeDB(db_pool, db_name)
+        students_grade = StudentDAO(db_pool, db_name)
         match args.create:
             case ['database']:
                 simulative.create_database()
@@ -345,6 +1420,13 @@ def main():
                 simulative.create_database()
                 simulative.create_table()
 
+        if args.upgrade:
+            simulative.upgrade()
+        if args.rebuild:
+            simulative.rebuild_daily_stats(args.start, args.end)
+        if args.retention:
+            simulative.drop_partitions(args.retention, detach_only=args.detach)
+
         match args.delete:
             case 'database':
                 simulative.drop_database()
@@ -354,11 +1436,15 @@ def main():
                 students_grade.clear_students_data()
         if args.fetch:
             students_grade.fetch_students_data()
+        if args.export:
+            file_format = args.format or (
+                'parquet' if args.export.endswith('.parquet') else 'csv')
+            students_grade.export_students_data(
+                args.export, args.start, args.end, args.attempt_type, file_format)
     except Exception as e:
         logger.error(f'Ошибка {repr(e)}')
     finally:
-        if db_connection:
-            db_connection.disconnect()
+        db_pool.disconnect()
 
 
 if __name__ == '__main__':
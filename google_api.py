@@ -1,20 +1,126 @@
+import threading
+
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
 from dotenv import load_dotenv
+from functools import cache
+from gspread.utils import a1_to_rowcol
 from os import environ
 
 
-def write_to_sheet(sheet_data):
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+
+@cache
+def get_client(credentials_path='credentials.json'):
+    """
+    Авторизованный клиент Google Sheets, создаётся один раз на процесс
+    """
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, SCOPE)
+    return gspread.authorize(credentials)
+
+
+class SheetPublisher:
+    """
+    Публикация отчёта в таблицу Google с историей по дням: первая колонка
+    листа содержит дату, для каждого дня хранится одна строка.
+    Строки уже опубликованных дней обновляются одним запросом batch_update,
+    новые дни добавляются одним запросом append_rows.
+    Клиент, лист и номера строк дней кэшируются между вызовами, клиент
+    можно передать явно (например, заглушку gspread для проверки).
+    """
+
+    def __init__(self, spreadsheet_id=None, worksheet_title=None, client=None):
+        if not spreadsheet_id:
+            load_dotenv()
+            spreadsheet_id = environ['SPREADSHEET_ID']
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet_title = worksheet_title
+        self.client = client
+        self._lock = threading.Lock()
+        self._worksheet = None
+        self._rows = None
+        self._last_row = 0
+
+    def get_worksheet(self):
+        if self._worksheet is None:
+            client = self.client or get_client()
+            workbook = client.open_by_key(self.spreadsheet_id)
+            if self.worksheet_title:
+                try:
+                    self._worksheet = workbook.worksheet(self.worksheet_title)
+                except gspread.exceptions.WorksheetNotFound:
+                    self._worksheet = workbook.add_worksheet(
+                        self.worksheet_title, rows=1000, cols=26)
+            else:
+                self._worksheet = workbook.sheet1
+        return self._worksheet
+
+    def load_rows(self):
+        """
+        Номера строк опубликованных дней по первой колонке листа
+        """
+        if self._rows is None:
+            days = self.get_worksheet().col_values(1)
+            self._rows = {day: row for row, day in enumerate(days, start=1) if day}
+            self._last_row = len(days)
+        return self._rows
+
+    def publish(self, sheet_data):
+        """
+        Публикация строк отчёта sheet_data: первая строка - заголовок,
+        остальные - по одной на день
+        """
+        header, *day_rows = sheet_data
+        with self._lock:
+            try:
+                self.__publish(header, day_rows)
+            except gspread.exceptions.APIError:
+                self._worksheet = None
+                self._rows = None
+                raise
+
+    def __publish(self, header, day_rows):
+        worksheet = self.get_worksheet()
+        rows = self.load_rows()
+        width = len(header)
+        updates = list()
+        new_rows = list()
+        if not self._last_row:
+            new_rows.append(header)
+        for day_row in day_rows:
+            row = rows.get(str(day_row[0]))
+            if row:
+                updates.append({
+                    'range': f'A{row}:{column_letter(width)}{row}',
+                    'values': [day_row],
+                })
+            else:
+                new_rows.append(day_row)
+        if updates:
+            worksheet.batch_update(updates)
+        if new_rows:
+            response = worksheet.append_rows(new_rows)
+            updated_range = response['updates']['updatedRange']
+            first_row, _ = a1_to_rowcol(updated_range.split('!')[-1].split(':')[0])
+            for row, new_row in enumerate(new_rows, start=first_row):
+                rows[str(new_row[0])] = row
+            self._last_row = max(self._last_row, first_row + len(new_rows) - 1)
+
+
+def column_letter(column):
+    letters = ''
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+@cache
+def get_publisher(spreadsheet_id=None, worksheet_title=None):
+    return SheetPublisher(spreadsheet_id, worksheet_title)
+
 
-    load_dotenv()
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-    gc = gspread.authorize(credentials)
-    spreadsheet_id = environ['SPREADSHEET_ID']
-    workbook = gc.open_by_key(spreadsheet_id)    
-    sheet = workbook.sheet1 
-    try:
-        sheet.update(sheet_data, 'A1:B3')        
-    except gspread.exceptions.APIError:
-        raise
+def write_to_sheet(sheet_data, spreadsheet_id=None, worksheet_title=None):
+    get_publisher(spreadsheet_id, worksheet_title).publish(sheet_data)
@@ -0,0 +1,108 @@
+import gzip
+import json
+import logging
+import mmap
+import os
+
+import requests_to_simulative as rs
+import metrics
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def chunk_ranges(mapped, chunk_size):
+    """
+    Разбиение файла на диапазоны байтов около chunk_size,
+    границы которых совпадают с концами строк
+    """
+    ranges = list()
+    start = 0
+    while start < len(mapped):
+        end = mapped.find(b'\n', min(start + chunk_size, len(mapped)))
+        end = len(mapped) if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def parse_lines(lines):
+    """
+    Разбор строк JSONL и преобразование записей для базы данных
+    """
+    students_data = (json.loads(line) for line in lines if line.strip())
+    return list(rs.format_for_db(students_data))
+
+
+def parse_chunk(path, start, end):
+    with open(path, 'rb') as dump_file:
+        with mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return parse_lines(mapped[start:end].splitlines())
+
+
+def run_parse(parse, *parse_args):
+    """
+    Разбор части файла в процессе пула. Вместе с записями возвращаются
+    метрики разбора этой части (records_parsed, records_skipped), которые
+    иначе остались бы в процессе пула.
+    """
+    metrics.reset()
+    students_data = parse(*parse_args)
+    return students_data, metrics.snapshot()
+
+
+def iter_chunks(path, chunk_size, chunk_lines):
+    """
+    Задания для разбора: диапазоны байтов несжатого файла
+    или пачки строк сжатого файла
+    """
+    with open(path, 'rb') as dump_file:
+        compressed = dump_file.read(2) == GZIP_MAGIC
+    if compressed:
+        with gzip.open(path, 'rb') as dump_file:
+            while lines := list(islice(dump_file, chunk_lines)):
+                yield parse_lines, (lines,)
+        return
+    if not Path(path).stat().st_size:
+        return
+    with open(path, 'rb') as dump_file:
+        with mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            ranges = chunk_ranges(mapped, chunk_size)
+    for start, end in ranges:
+        yield parse_chunk, (path, start, end)
+
+
+def iter_file_records(path, workers=None, chunk_size=16 * 1024 * 1024,
+                      chunk_lines=50000):
+    """
+    Чтение выгрузки JSONL (в том числе сжатой gzip) и разбор записей
+    в пуле процессов. Записи возвращаются в порядке следования в файле,
+    одновременно обрабатывается не больше 2 * workers частей файла.
+    Метрики разбора процессов пула добавляются к метрикам запуска.
+    """
+    workers = workers or os.cpu_count()
+    records_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = 2 * workers
+        pending = deque()
+        for parse, parse_args in iter_chunks(path, chunk_size, chunk_lines):
+            pending.append(executor.submit(run_parse, parse, *parse_args))
+            if len(pending) < max_pending:
+                continue
+            students_data, chunk_metrics = pending.popleft().result()
+            metrics.merge(chunk_metrics)
+            records_count += len(students_data)
+            yield from students_data
+        while pending:
+            students_data, chunk_metrics = pending.popleft().result()
+            metrics.merge(chunk_metrics)
+            records_count += len(students_data)
+            yield from students_data
+    logger.info(f'Из файла {path} прочитано {records_count} записей')
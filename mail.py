@@ -1,20 +1,205 @@
+import logging
 import smtplib
+import threading
+
+import metrics
+
 from email.message import EmailMessage
+from email.utils import parseaddr
+from functools import cache
+from queue import Queue, Empty
+from string import Template
+from time import sleep
 
 from dotenv import load_dotenv
 from os import environ
 
 
+logger = logging.getLogger(__name__)
+
+SUBJECT = "Данные по студентам"
+DEFAULT_TEMPLATE = '$report'
+
+
+def is_transient(error):
+    """
+    Временная ошибка SMTP, после которой отправку можно повторить
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+class MailDispatcher:
+    """
+    Отправка писем через одно авторизованное соединение SMTP.
+    Письма, поставленные в очередь методами submit и submit_report,
+    отправляются в фоновом потоке пачками: все письма, накопившиеся
+    в очереди, уходят через одно соединение, после чего оно закрывается.
+    Временные ошибки повторяются retries раз с экспоненциальной задержкой.
+    Параметры сервера по умолчанию берутся из переменных окружения
+    SMTP_HOST, SMTP_PORT, SMTP_SSL, EMAIL_ADDRESS и EMAIL_PASSWORD.
+    """
+
+    def __init__(self, host=None, port=None, email_address=None, password=None,
+                 use_ssl=None, retries=3, backoff=1.0, queue_size=1000, timeout=30):
+        load_dotenv()
+        self.host = host or environ.get('SMTP_HOST', 'smtp.mail.ru')
+        self.port = port or int(environ.get('SMTP_PORT', 465))
+        self.email_address = email_address or environ['EMAIL_ADDRESS']
+        self.password = password if password is not None else environ.get('EMAIL_PASSWORD')
+        self.use_ssl = use_ssl if use_ssl is not None else environ.get('SMTP_SSL', '1') != '0'
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._finished = object()
+        self._thread = None
+        self._server = None
+
+    def connect(self):
+        """
+        Авторизованное соединение с сервером. Соединение сохраняется
+        только после успешного входа, иначе закрывается.
+        """
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.password:
+            try:
+                server.login(self.email_address, self.password)
+            except Exception:
+                server.close()
+                raise
+        self._server = server
+        return server
+
+    def disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except smtplib.SMTPException:
+            self._server.close()
+        except OSError:
+            pass
+        self._server = None
+
+    def create_message(self, msg_to, msg_txt, subject=SUBJECT):
+        msg = EmailMessage()
+        msg.set_content(msg_txt)
+        msg["Subject"] = subject
+        msg["From"] = self.email_address
+        msg["To"] = msg_to
+        return msg
+
+    def send_batch(self, messages):
+        """
+        Отправка писем через одно соединение.
+        Возвращает количество отправленных и неотправленных писем.
+        """
+        sent = 0
+        failed = 0
+        with metrics.timer('mail_batch'):
+            for msg in messages:
+                for attempt in range(self.retries):
+                    try:
+                        server = self._server or self.connect()
+                        server.send_message(msg)
+                        sent += 1
+                        break
+                    except Exception as e:
+                        if not isinstance(e, smtplib.SMTPResponseException):
+                            self.disconnect()
+                        if not is_transient(e) or attempt == self.retries - 1:
+                            logger.error(f'Письмо для {msg["To"]} не отправлено: {repr(e)}')
+                            failed += 1
+                            break
+                        logger.warning(f'Ошибка отправки письма для {msg["To"]} '
+                                       f'(попытка {attempt + 1}): {repr(e)}')
+                        sleep(self.backoff * 2 ** attempt)
+            self.disconnect()
+        self.sent += sent
+        self.failed += failed
+        metrics.increment('mail_sent', sent)
+        metrics.increment('mail_failed', failed)
+        return sent, failed
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.__run, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, msg_to, msg_txt, subject=SUBJECT):
+        self._queue.put(self.create_message(msg_to, msg_txt, subject))
+
+    def submit_report(self, recipients, report, template=None, subject=SUBJECT):
+        """
+        Постановка в очередь отчёта report для каждого получателя.
+        Шаблон template (string.Template) может содержать $report,
+        $recipient (адрес) и $name (имя из записи вида "Имя <адрес>").
+        """
+        template = Template(template or DEFAULT_TEMPLATE)
+        for recipient in recipients:
+            name, address = parseaddr(recipient)
+            msg_txt = template.safe_substitute(
+                report=report, recipient=address, name=name or address)
+            self.submit(recipient, msg_txt, subject)
+
+    def close(self):
+        """
+        Отправка оставшихся в очереди писем и остановка фонового потока
+        """
+        if self._thread is None:
+            return
+        self._queue.put(self._finished)
+        self._thread.join()
+        self._thread = None
+        logger.info(f'Писем отправлено: {self.sent}, не отправлено: {self.failed}')
+
+    def __run(self):
+        finished = False
+        while not finished:
+            messages = [self._queue.get()]
+            while True:
+                try:
+                    messages.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            if self._finished in messages:
+                finished = True
+                messages = [msg for msg in messages if msg is not self._finished]
+            if messages:
+                self.send_batch(messages)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@cache
+def get_dispatcher():
+    return MailDispatcher().start()
+
+
+def close_dispatcher():
+    if get_dispatcher.cache_info().currsize:
+        get_dispatcher().close()
+        get_dispatcher.cache_clear()
+
+
 def send_email(msg_to, msg_txt):
-        
-    load_dotenv()
-    email_address = environ['EMAIL_ADDRESS']
-    email_password = environ['EMAIL_PASSWORD']
-    msg = EmailMessage()
-    msg.set_content(msg_txt)
-    msg["Subject"] = "Данные по студентам"
-    msg["From"] = email_address
-    msg["To"] = msg_to
-    with smtplib.SMTP_SSL("smtp.mail.ru", 465) as server:
-        server.login(email_address, email_password)
-        server.send_message(msg)
+    dispatcher = MailDispatcher()
+    _, failed = dispatcher.send_batch([dispatcher.create_message(msg_to, msg_txt)])
+    if failed:
+        raise smtplib.SMTPException(f'Письмо для {msg_to} не отправлено')
@@ -0,0 +1,236 @@
+import json
+import logging
+import sys
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'simulative'
+
+_lock = threading.Lock()
+_counters = dict()
+_gauges = dict()
+_timers = dict()
+_profiling = {'stages': set(), 'tracemalloc': False, 'profile_dir': Path('profiles')}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """
+    Увеличение счётчика name с метками labels
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """
+    Установка текущего значения показателя name
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """
+    Учёт длительности операции name в секундах
+    """
+    key = _key(name, labels)
+    with _lock:
+        count, total, maximum = _timers.get(key, (0, 0.0, 0.0))
+        _timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+
+@contextmanager
+def timer(name, **labels):
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, perf_counter() - started, **labels)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+
+
+def snapshot():
+    """
+    Копия счётчиков, показателей и таймеров для передачи из дочернего
+    процесса в основной
+    """
+    with _lock:
+        return dict(_counters), dict(_gauges), dict(_timers)
+
+
+def merge(metrics_snapshot, **labels):
+    """
+    Добавление метрик snapshot() другого процесса с дополнительными
+    метками labels
+    """
+    counters, gauges, timers = metrics_snapshot
+
+    def relabel(key):
+        name, key_labels = key
+        return _key(name, {**dict(key_labels), **labels})
+
+    with _lock:
+        for key, value in counters.items():
+            key = relabel(key)
+            _counters[key] = _counters.get(key, 0) + value
+        for key, value in gauges.items():
+            _gauges[relabel(key)] = value
+        for key, (count, total, maximum) in timers.items():
+            key = relabel(key)
+            old_count, old_total, old_maximum = _timers.get(key, (0, 0.0, 0.0))
+            _timers[key] = (old_count + count, old_total + total, max(old_maximum, maximum))
+
+
+def summary():
+    """
+    Сводка счётчиков и таймеров в виде словаря
+    """
+    def label_text(labels):
+        return ','.join(f'{label}={value}' for label, value in labels)
+
+    with _lock:
+        return {
+            'counters': {
+                f'{name}{{{label_text(labels)}}}' if labels else name: value
+                for (name, labels), value in sorted(_counters.items())
+            },
+            'gauges': {
+                f'{name}{{{label_text(labels)}}}' if labels else name: value
+                for (name, labels), value in sorted(_gauges.items())
+            },
+            'timers': {
+                f'{name}{{{label_text(labels)}}}' if labels else name: {
+                    'count': count,
+                    'seconds': round(total, 6),
+                    'max_seconds': round(maximum, 6),
+                }
+                for (name, labels), (count, total, maximum) in sorted(_timers.items())
+            },
+        }
+
+
+def export_json(path):
+    Path(path).write_text(
+        json.dumps(summary(), ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+def export_prometheus(path):
+    """
+    Запись метрик в текстовый файл для node_exporter textfile collector
+    """
+    def label_text(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+    lines = list()
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        timers = sorted(_timers.items())
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+        lines.extend(f'{PREFIX}_{name}_total{label_text(labels)} {value}'
+                     for (counter_name, labels), value in counters if counter_name == name)
+    for name in sorted({name for (name, _), _ in gauges}):
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        lines.extend(f'{PREFIX}_{name}{label_text(labels)} {value}'
+                     for (gauge_name, labels), value in gauges if gauge_name == name)
+    for name in sorted({name for (name, _), _ in timers}):
+        lines.append(f'# TYPE {PREFIX}_{name}_seconds summary')
+        for (timer_name, labels), (count, total, maximum) in timers:
+            if timer_name != name:
+                continue
+            lines.append(f'{PREFIX}_{name}_seconds_count{label_text(labels)} {count}')
+            lines.append(f'{PREFIX}_{name}_seconds_sum{label_text(labels)} {total:.6f}')
+            lines.append(f'{PREFIX}_{name}_seconds_max{label_text(labels)} {maximum:.6f}')
+    temp_path = Path(f'{path}.tmp')
+    temp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    temp_path.replace(path)
+
+
+def enable_profiling(stages, trace_memory=False, profile_dir='profiles'):
+    """
+    Включение cProfile для стадий stages и tracemalloc для тех же стадий
+    """
+    _profiling['stages'] = set(stages)
+    _profiling['tracemalloc'] = trace_memory
+    _profiling['profile_dir'] = Path(profile_dir)
+
+
+@contextmanager
+def profile(stage):
+    """
+    Профилирование стадии stage, если оно включено через enable_profiling.
+    Вызывающий поток и потоки, запущенные во время стадии (поток получения
+    данных, пул загрузки окон), профилируются отдельными объектами cProfile
+    (с Python 3.12 - одним объектом для всех потоков), статистика которых
+    объединяется и сохраняется в profile_dir/<stage>.prof. Ошибка включения
+    профилировщика потока не мешает работе потока.
+    Пиковая память tracemalloc записывается в журнал и в показатель
+    peak_traced_bytes.
+    """
+    if stage not in _profiling['stages']:
+        yield
+        return
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    thread_profilers = list()
+
+    def profile_thread(frame, event, arg):
+        thread_profiler = cProfile.Profile()
+        try:
+            thread_profiler.enable()
+        except ValueError:
+            return
+        with _lock:
+            thread_profilers.append(thread_profiler)
+
+    if _profiling['tracemalloc']:
+        tracemalloc.start()
+    # С Python 3.12 cProfile работает через sys.monitoring и профилирует
+    # все потоки, а второй профилировщик включить нельзя
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        stats = pstats.Stats(profiler)
+        with _lock:
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+        _profiling['profile_dir'].mkdir(parents=True, exist_ok=True)
+        profile_path = _profiling['profile_dir'] / f'{stage}.prof'
+        stats.dump_stats(profile_path)
+        logger.info(f'Профиль стадии {stage} (потоков: {len(thread_profilers) + 1}) '
+                    f'сохранён в {profile_path}')
+        if _profiling['tracemalloc']:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            set_gauge('peak_traced_bytes', peak, stage=stage)
+            logger.info(f'Пиковая память стадии {stage}: {peak} байт')
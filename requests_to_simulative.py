@@ -1,14 +1,47 @@
-import requests
+import codecs
+import json
+import re
 import logging
+import metrics
 
-from datetime import datetime as dt
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from datetime import datetime as dt, timedelta
+from sys import intern
+from time import sleep
 
 
 logger = logging.getLogger(__name__) 
 
+API_URL = "https://b2b.itresume.ru/api/statistics"
+API_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+PASSBACK_VALUE_PATTERN = re.compile(
+    r'''['"]?\w+['"]?\s*:\s*(?:'([^']*)'|"([^"]*)"|([^,}\s]*))''')
+# Запись для базы данных: кортеж без словаря атрибутов, поля в порядке
+# колонок students_grade
+StudentRecord = namedtuple('StudentRecord', [
+    'user_id',
+    'oauth_consumer_key',
+    'lis_result_sourcedid',
+    'lis_outcome_service_url',
+    'is_correct',
+    'attempt_type',
+    'created_at',
+])
+# Создание записи без разбора аргументов в StudentRecord.__new__
+new_record = tuple.__new__
+WINDOWS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+
+def fetch_students_data(client, client_key, start_date, end_date,
+                        api_url=API_URL, session=None, timeout=60):
+    import requests
 
-def fetch_students_data(client, client_key, start_date, end_date):
-    api_url = "https://b2b.itresume.ru/api/statistics"
     payload = {
         'client': client,
         'client_key': client_key,  # - M2MGWS (регистр важен)
@@ -16,36 +49,269 @@ def fetch_students_data(client, client_key, start_date, end_date):
         'start': start_date,
         'end': end_date
     }
-    response = requests.get(api_url, params=payload)
+    with metrics.timer('api_request'):
+        response = (session or requests).get(api_url, params=payload, timeout=timeout)
+    metrics.increment('api_bytes', len(response.content))
     logger.info('Данные получены')
     response.raise_for_status()
     return response.json()
 
 
-def format_for_db(students_data):    
-    formatted_data = list()
-    for student_data in students_data:        
-        db_data = dict()        
-        db_data['user_id'] = student_data.get('lti_user_id')
-        if not db_data.get('user_id'):
+def iter_json_array(chunks):
+    """
+    Инкрементальный разбор JSON-массива, поступающего частями.
+    Элементы массива возвращаются по мере получения, без чтения всего ответа.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Ответ API не является JSON-массивом')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                value, position_end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            position = position_end
+            yield value
+    raise ValueError('Ответ API оборван')
+
+
+def stream_students_data(session, client, client_key, start_date, end_date,
+                         api_url=API_URL, timeout=60, chunk_size=64 * 1024):
+    """
+    Потоковая загрузка данных: записи разбираются по мере чтения ответа
+    """
+    payload = {
+        'client': client,
+        'client_key': client_key,
+        'start': start_date,
+        'end': end_date
+    }
+    with metrics.timer('api_request'):
+        response = session.get(api_url, params=payload, timeout=timeout, stream=True)
+    with response:
+        response.raise_for_status()
+        yield from iter_json_array(count_bytes(response.iter_content(chunk_size=chunk_size)))
+
+
+def count_bytes(chunks):
+    for chunk in chunks:
+        metrics.increment('api_bytes', len(chunk))
+        yield chunk
+
+
+def split_period(start_date, end_date, window):
+    """
+    Разбиение периода [start_date, end_date) на окна длительностью window
+    """
+    windows = list()
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + window, end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def is_retryable(error):
+    """
+    Ошибка, после которой загрузку окна можно повторить: ошибка сервера
+    (5xx), превышение лимита запросов (429), тайм-аут, разрыв соединения
+    или оборванный ответ. Остальные ошибки клиента (например, 401 или 403
+    при неверном client_key) не исчезнут при повторе.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True
+    return response.status_code >= 500 or response.status_code in (408, 429)
+
+
+def fetch_window(session, client, client_key, window_start, window_end,
+                 api_url=API_URL, retries=3, backoff=1.0,
+                 min_window=timedelta(minutes=5), cache=None):
+    """
+    Загрузка данных за одно окно с повторными попытками.
+    После исчерпания попыток окно делится пополам и каждая половина
+    загружается заново, пока окно не станет меньше min_window.
+    Ошибки клиента (4xx, см. is_retryable) передаются вызывающему сразу.
+    При наличии кэша окно сначала ищется в нём.
+    """
+    import requests
+
+    if cache:
+        students_data = cache.get(client, window_start, window_end)
+        if students_data is not None:
+            return students_data
+    for attempt in range(retries):
+        try:
+            students_data = list(stream_students_data(
+                session, client, client_key,
+                window_start.strftime(API_DATE_FORMAT),
+                window_end.strftime(API_DATE_FORMAT),
+                api_url=api_url
+            ))
+            break
+        except (requests.RequestException, ValueError) as e:
+            if not is_retryable(e):
+                logger.error(f'Ошибка загрузки окна {window_start} - {window_end}: {repr(e)}')
+                raise
+            logger.warning(f'Ошибка загрузки окна {window_start} - {window_end} '
+                           f'(попытка {attempt + 1}): {repr(e)}')
+            if attempt < retries - 1:
+                sleep(backoff * 2 ** attempt)
+    else:
+        if window_end - window_start <= min_window:
+            raise requests.RequestException(
+                f'Не удалось загрузить данные за период {window_start} - {window_end}')
+        middle = window_start + (window_end - window_start) / 2
+        logger.info(f'Окно {window_start} - {window_end} разбито пополам')
+        return [
+            *fetch_window(session, client, client_key, window_start, middle,
+                          api_url, retries, backoff, min_window, cache),
+            *fetch_window(session, client, client_key, middle, window_end,
+                          api_url, retries, backoff, min_window, cache),
+        ]
+    if cache:
+        cache.put(client, window_start, window_end, students_data)
+    return students_data
+
+
+def create_session(max_workers=4):
+    """
+    Сеанс HTTP с пулом keep-alive соединений на max_workers запросов.
+    Модуль requests загружается только при работе с API.
+    """
+    import requests
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def iter_students_data(client, client_key, start_date, end_date,
+                       window='day', max_workers=4, api_url=API_URL,
+                       retries=3, backoff=1.0, cache=None, session=None):
+    """
+    Параллельная загрузка данных окнами (час или день) через общий
+    keep-alive сеанс. Одновременно в памяти находится не больше max_workers
+    окон, записи возвращаются генератором в исходном порядке окон.
+    Переданный сеанс session не закрывается и может использоваться повторно.
+    """
+    windows = split_period(
+        dt.fromisoformat(start_date), dt.fromisoformat(end_date), WINDOWS[window])
+    records_count = 0
+    with ExitStack() as stack:
+        if session is None:
+            session = stack.enter_context(create_session(max_workers))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for period in windows:
+                pending.append(executor.submit(
+                    fetch_window, session, client, client_key, *period,
+                    api_url=api_url, retries=retries, backoff=backoff, cache=cache))
+                if len(pending) < max_workers:
+                    continue
+                window_data = pending.popleft().result()
+                records_count += len(window_data)
+                yield from window_data
+            while pending:
+                window_data = pending.popleft().result()
+                records_count += len(window_data)
+                yield from window_data
+    logger.info(f'Получено {records_count} записей за {len(windows)} окон')
+
+
+def parse_passback_params(passback_params):
+    """
+    Разбор строки passback_params вида
+    "{'oauth_consumer_key': '', 'lis_result_sourcedid': '...', 'lis_outcome_service_url': '...'}".
+    Возвращает значения полей в порядке следования.
+    Обычная строка с ключами и значениями в одинарных кавычках разбирается
+    одним split, остальные варианты - регулярным выражением.
+    """
+    parts = passback_params.split("'")
+    if len(parts) % 4 == 1 and parts[0].strip() == '{' and parts[-1].strip() == '}':
+        return parts[3::4]
+    return [quoted or double_quoted or bare
+            for quoted, double_quoted, bare
+            in PASSBACK_VALUE_PATTERN.findall(passback_params)]
+
+
+@lru_cache(maxsize=65536)
+def parse_passback_values(passback_params):
+    """
+    Интернированные ключ потребителя, идентификатор задания и адрес сервиса
+    из passback_params или None при неверном формате. Строка passback_params
+    одинакова для всех попыток одного задания, поэтому результаты кэшируются.
+    """
+    passback_values = parse_passback_params(passback_params)
+    if len(passback_values) < 2:
+        return None
+    return (
+        intern(passback_values[0]) if passback_values[0] else None,
+        intern(passback_values[1]),
+        intern(passback_values[2]) if len(passback_values) > 2 else None,
+    )
+
+
+def format_for_db(students_data):
+    """
+    Преобразование записей API в записи StudentRecord для базы данных.
+    Функция является генератором и не накапливает записи в памяти.
+    Повторяющиеся строки (пользователь, задание, ключ потребителя, адрес
+    сервиса, тип попытки) интернируются, поэтому записи одной пачки
+    ссылаются на общие объекты строк.
+    """
+    formatted_count = 0
+    skipped_count = 0
+    for student_data in students_data:
+        user_id = student_data.get('lti_user_id')
+        if not user_id:
+            skipped_count += 1
             continue
         passback_params = student_data.get('passback_params')
         if not passback_params:
+            skipped_count += 1
+            continue
+        passback_values = parse_passback_values(passback_params)
+        if not passback_values:
+            logger.warning(f'Неверный формат passback_params: {passback_params}')
+            skipped_count += 1
             continue
-        passback_params = passback_params.split(',')
-        passback_params = [passback_param.strip().replace("'", '').replace('}', '').split(' ')
-                           for passback_param in passback_params]
-        db_data['oauth_consumer_key'] = passback_params[0][1] if passback_params[0][1] else None
-        db_data['lis_result_sourcedid'] = passback_params[1][1]
-        db_data['lis_outcome_service_url'] = passback_params[2][1] if len(
-            passback_params) == 3 else None
-        db_data['is_correct'] = student_data.get('is_correct')
-        db_data['attempt_type'] = student_data.get('attempt_type')
-        db_data['created_at'] = dt.strptime(
-            student_data.get('created_at'), "%Y-%m-%d %H:%M:%S.%f")
-        formatted_data.append(db_data)
-    logger.info('Данные обработаны')
-    return formatted_data
+        consumer_key, sourcedid, service_url = passback_values
+        formatted_count += 1
+        attempt_type = student_data.get('attempt_type')
+        yield new_record(StudentRecord, (
+            intern(user_id),
+            consumer_key,
+            sourcedid,
+            service_url,
+            student_data.get('is_correct'),
+            intern(attempt_type) if attempt_type else None,
+            dt.fromisoformat(student_data.get('created_at')),
+        ))
+    metrics.increment('records_parsed', formatted_count)
+    metrics.increment('records_skipped', skipped_count)
+    logger.info(f'Данные обработаны: {formatted_count} записей, пропущено {skipped_count}')
 
 
 # a = fetch_students_data('Skillfactory', 'M2MGWS',
@@ -1,16 +1,22 @@
+import json
 import logging
 import re
 import argparse
+import threading
 
 import requests_to_simulative as rs
 import db_operations as db
+import metrics
 
 from dotenv import load_dotenv
 from os import environ, listdir
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from mail import send_email
-from google_api import write_to_sheet
+from queue import Queue, Full
+from time import sleep
+
+
+ANALYTICS_WORKSHEET = 'Аналитика'
 
 
 def setup_logging():
@@ -71,6 +77,21 @@ def create_date_pattern():
         r'\b' + year_part + r'-' + month_part + r'-' + day_part + r'\b')
 
 
+def iso_date(value):
+    if not re.fullmatch(create_date_pattern(), value):
+        raise argparse.ArgumentTypeError(f'Дата {value} не в формате YYYY-MM-DD')
+    return value
+
+
+def load_config(config_path):
+    """
+    Значения аргументов из файла JSON: ключи совпадают с длинными
+    именами аргументов (например "mail-to" или "mail_to")
+    """
+    config = json.loads(Path(config_path).read_text(encoding='utf-8'))
+    return {key.replace('-', '_'): value for key, value in config.items()}
+
+
 def input_dates():
     start_date = None
     end_date = None
@@ -113,16 +134,149 @@ def input_get_date():
         return get_date.string
 
 
-def get_students_data(students_grade):
-    num_queries = 3
-    get_date = input_get_date()
-    if not get_date:
+def load_end(end_date):
+    """
+    Граница загрузки из API для конечной даты end_date. Дата YYYY-MM-DD
+    входит в период целиком, как в отчёте, выгрузке и аналитике, поэтому
+    загрузка выполняется до начала следующего дня. Дата со временем
+    остаётся исключённой границей.
+    """
+    if len(end_date) > 10:
+        return end_date
+    return (datetime.fromisoformat(end_date) + timedelta(days=1)).date().isoformat()
+
+
+def get_students_data(students_grade, period=False, start_date=None, end_date=None):
+    """
+    Метрики по дням за день или период. Даты, не переданные в параметрах,
+    запрашиваются у пользователя.
+    """
+    if not start_date:
+        if period:
+            start_date, end_date = input_dates()
+        else:
+            start_date = input_get_date()
+    if not start_date:
         return
-    students_data = list()
-    for num_query in range(1, num_queries + 1):
-        students_data.append(
-            students_grade.fetch_students_data(num_query, get_date))        
-    return students_data
+    return students_grade.fetch_daily_metrics(start_date, end_date or start_date)
+
+
+def create_report(students_data):
+    """
+    Формирование текста письма и строк таблицы: одна строка на каждый день
+    """
+    msg_txt = '\n'.join(
+        f'''{day}: Количество уникальных пользователей {unique_users};
+                      Количество совершённых попыток {attempts};
+                      Количество успешных попыток {submits}'''
+        for day, unique_users, attempts, submits in students_data
+    )
+    sheet_data = [
+        ['Дата',
+         'Количество уникальных пользователей',
+         'Количество совершённых попыток',
+         'Количество успешных попыток'],
+        *([day.isoformat(), unique_users, attempts, submits]
+          for day, unique_users, attempts, submits in students_data),
+    ]
+    return msg_txt, sheet_data
+
+
+def load_students_data(students_grade, students_data, batch_size=1000,
+                       commit_every=10000, method='copy', queue_size=4):
+    """
+    Конвейер загрузки: получение и разбор данных выполняются в отдельном
+    потоке и передаются в запись пачками через ограниченную очередь,
+    поэтому в памяти находится не больше queue_size пачек. При ошибке
+    записи поток получения останавливается, а генератор students_data
+    закрывается.
+    Возвращает количество добавленных записей, количество записей, которые
+    не удалось добавить, и время создания последней полученной записи.
+    """
+    batches = Queue(maxsize=queue_size)
+    finished = object()
+    stopped = threading.Event()
+    errors = list()
+    latest_created_at = None
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        nonlocal latest_created_at
+        try:
+            for batch in db.batched(rs.format_for_db(students_data), batch_size):
+                batch_latest = max(student_data.created_at for student_data in batch)
+                if not latest_created_at or batch_latest > latest_created_at:
+                    latest_created_at = batch_latest
+                if not put(batch):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if stopped.is_set() and hasattr(students_data, 'close'):
+                students_data.close()
+            put(finished)
+
+    def consume():
+        while (batch := batches.get()) is not finished:
+            yield from batch
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        inserted, failed = students_grade.insert_students_data(
+            consume(),
+            batch_size=batch_size,
+            commit_every=commit_every,
+            method=method
+        )
+    finally:
+        stopped.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+    return inserted, failed, latest_created_at
+
+
+def sync_students_data(students_grade, client, client_key,
+                       fetch_options, load_options, start_date=None, interactive=True):
+    """
+    Инкрементальная синхронизация: загрузка записей, созданных после
+    отметки синхронизации клиента, и сдвиг отметки после успешной загрузки.
+    При первом запуске используется start_date или дата, запрошенная
+    у пользователя. Без отметки и начальной даты в неинтерактивном режиме
+    возбуждается ValueError.
+    Возвращает количество добавленных записей и количество записей,
+    которые не удалось добавить, или None, если пользователь не ввёл дату.
+    """
+    logger = logging.getLogger(__name__)
+    watermark = students_grade.get_watermark(client)
+    if watermark:
+        start_date = watermark.isoformat(sep=' ')
+    elif not start_date and interactive:
+        start_date = input_get_date()
+        if not start_date:
+            return None
+    if not start_date:
+        raise ValueError(f'Нет отметки синхронизации {client} и не задана начальная дата')
+    end_date = datetime.now(timezone.utc).replace(tzinfo=None).isoformat(sep=' ')
+    logger.info(f'Синхронизация {client} с {start_date} по {end_date}')
+    fetching_data = rs.iter_students_data(
+        client, client_key, start_date, end_date, **fetch_options)
+    inserted, failed, latest_created_at = load_students_data(
+        students_grade, fetching_data, **load_options)
+    if failed:
+        logger.warning('Отметка синхронизации не сдвинута из-за ошибок записи')
+    elif latest_created_at:
+        students_grade.set_watermark(client, latest_created_at)
+    return inserted, failed
 
 
 def get_mail_address():
@@ -138,10 +292,183 @@ def get_mail_address():
         return mail_address
 
 
+def publish_sheet(sheet_data, spreadsheet_id=None, worksheet_title=None):
+    from google_api import write_to_sheet
+
+    logger = logging.getLogger(__name__)
+    with metrics.profile('publish'), metrics.timer('publish', target='sheet'):
+        write_to_sheet(sheet_data, spreadsheet_id, worksheet_title)
+    logger.info("Данные успешно записаны в таблицу!")
+
+
+def publish_mail(recipients, msg_txt, template=None):
+    """
+    Постановка отчёта в очередь отправки писем: письма отправляются
+    в фоновом потоке через одно соединение SMTP
+    """
+    from mail import get_dispatcher
+
+    logger = logging.getLogger(__name__)
+    with metrics.timer('publish', target='mail'):
+        get_dispatcher().submit_report(recipients, msg_txt, template)
+    logger.info(f'Писем поставлено в очередь: {len(recipients)}')
+
+
+def read_template(template_path):
+    if not template_path:
+        return None
+    return Path(template_path).read_text(encoding='utf-8')
+
+
+def get_recipients(mail_to, interactive=True):
+    if mail_to:
+        return mail_to
+    if not interactive:
+        return []
+    msg_to = get_mail_address()
+    return [msg_to] if msg_to else []
+
+
+def send_report(msg_txt, sheet_data, fetch, mail_to=None, spreadsheet_id=None,
+                mail_template=None, interactive=True, worksheet_title=None):
+    """
+    Публикация готового отчёта в таблицу и (или) по почте всем получателям
+    """
+    if not fetch:
+        return
+    if 'sheet' in fetch:
+        publish_sheet(sheet_data, spreadsheet_id, worksheet_title)
+    if 'mail' in fetch:
+        recipients = get_recipients(mail_to, interactive)
+        if recipients:
+            publish_mail(recipients, msg_txt, mail_template)
+
+
+def publish_report(students_data, fetch, mail_to=None, spreadsheet_id=None,
+                   mail_template=None, interactive=True):
+    """
+    Публикация отчёта по дням в таблицу и (или) по почте всем получателям
+    """
+    if not fetch:
+        return
+    msg_txt, sheet_data = create_report(students_data)
+    send_report(msg_txt, sheet_data, fetch, mail_to, spreadsheet_id,
+                mail_template, interactive)
+
+
+def publish_analytics(students_grade, args):
+    """
+    Аналитика прогресса студентов за период --start - --end: сохранение
+    таблиц в --analytics-dir и публикация отчёта по когортам на отдельный
+    лист таблицы и по почте
+    """
+    import analytics
+
+    start_date, end_date = args.start, args.end
+    if not start_date:
+        start_date, end_date = input_dates()
+        if not start_date:
+            return
+    with metrics.profile('analytics'), metrics.timer('stage', stage='analytics'):
+        results = analytics.analyze(students_grade, start_date, end_date)
+    if not results:
+        return
+    if args.analytics_dir:
+        analytics.save_results(results, args.analytics_dir)
+    msg_txt, sheet_data = analytics.create_report(results)
+    send_report(msg_txt, sheet_data, args.fetch, args.mail_to, args.spreadsheet_id,
+                read_template(args.mail_template), worksheet_title=ANALYTICS_WORKSHEET)
+
+
+def create_publishers(fetch, mail_to=None, spreadsheet_id=None, mail_template=None):
+    """
+    Функции публикации отчёта для асинхронного режима.
+    Адрес почты запрашивается заранее, чтобы загрузка шла без участия пользователя.
+    """
+    publishers = list()
+    if fetch and 'sheet' in fetch:
+        def publish_report_sheet(students_data):
+            _, sheet_data = create_report(students_data)
+            publish_sheet(sheet_data, spreadsheet_id)
+        publishers.append(publish_report_sheet)
+    if fetch and 'mail' in fetch:
+        recipients = get_recipients(mail_to)
+        if recipients:
+            def publish_report_mail(students_data):
+                msg_txt, _ = create_report(students_data)
+                publish_mail(recipients, msg_txt, mail_template)
+            publishers.append(publish_report_mail)
+    return publishers
+
+
+def run_daemon(students_grade, client, client_key, args, fetch_options, load_options):
+    """
+    Работа по расписанию: синхронизация каждые args.interval минут
+    и ежедневный отчёт за прошедшие сутки в args.report_at (ЧЧ:ММ),
+    если задан args.fetch. Пул соединений с базой и сеанс HTTP сохраняются между запусками.
+    """
+    logger = logging.getLogger(__name__)
+    interval = timedelta(minutes=args.interval)
+    next_sync = datetime.now()
+    next_report = None
+    if args.report_at and args.fetch:
+        report_time = datetime.strptime(args.report_at, '%H:%M').time()
+        next_report = datetime.combine(datetime.now().date(), report_time)
+        if next_report <= datetime.now():
+            next_report += timedelta(days=1)
+    logger.info('Запущен режим работы по расписанию')
+    while True:
+        now = datetime.now()
+        if now >= next_sync:
+            try:
+                with metrics.timer('stage', stage='sync'):
+                    sync_students_data(students_grade, client, client_key,
+                                       fetch_options, load_options,
+                                       start_date=args.start, interactive=False)
+            except Exception as e:
+                logger.error(f'Ошибка синхронизации {repr(e)}')
+            next_sync = now + interval
+        if next_report and now >= next_report:
+            report_date = (next_report - timedelta(days=1)).date().isoformat()
+            try:
+                students_data = students_grade.fetch_daily_metrics(report_date, report_date)
+                if students_data:
+                    publish_report(students_data, args.fetch, args.mail_to,
+                                   args.spreadsheet_id, read_template(args.mail_template),
+                                   interactive=False)
+            except Exception as e:
+                logger.error(f'Ошибка отчёта за {report_date} {repr(e)}')
+            next_report += timedelta(days=1)
+        export_metrics(args.metrics_dir)
+        wake_up = min(moment for moment in (next_sync, next_report) if moment)
+        sleep(max((wake_up - datetime.now()).total_seconds(), 0))
+
+
+def export_metrics(metrics_dir):
+    """
+    Сводка метрик запуска: в журнал и, если задана папка, в файлы
+    simulative.prom (формат Prometheus) и simulative_metrics.json
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(f'Метрики запуска: {json.dumps(metrics.summary(), ensure_ascii=False)}')
+    if not metrics_dir:
+        return
+    metrics_dir = Path(metrics_dir)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    metrics.export_prometheus(metrics_dir / 'simulative.prom')
+    metrics.export_json(metrics_dir / 'simulative_metrics.json')
+
+
 def create_parser():
     parser = argparse.ArgumentParser(
         description='Работа данными'
     )
+    parser.add_argument(
+        '-c',
+        '--config',
+        help='Файл JSON со значениями аргументов по умолчанию',
+        required=False,
+    )
     parser.add_argument(
         '-l',
         '--load',
@@ -149,6 +476,30 @@ def create_parser():
         required=False,
         action='store_true'
     )
+    parser.add_argument(
+        '-i',
+        '--ingest-file',
+        help='Загрузка данных из файла JSONL (в том числе сжатого gzip) вместо API',
+        required=False,
+    )
+    parser.add_argument(
+        '--clients',
+        help='Файл JSON со списком клиентов для параллельной загрузки в отдельных процессах',
+        required=False,
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        help='Количество процессов для разбора файла или загрузки клиентов',
+        required=False,
+    )
+    parser.add_argument(
+        '-s',
+        '--sync',
+        help='Загрузка новых данных с момента последней синхронизации',
+        required=False,
+        action='store_true'
+    )
     parser.add_argument(
         '-f',
         '--fetch',
@@ -157,7 +508,170 @@ def create_parser():
         help='Извлечение и передача данных',
         required=False,
     )
+    parser.add_argument(
+        '-p',
+        '--period',
+        help='Отчёт за период (по дням) вместо одного дня',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '-a',
+        '--async',
+        dest='async_mode',
+        help='Асинхронная загрузка данных и публикация отчёта за период загрузки',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--db-connections',
+        type=int,
+        default=10,
+        help='Наибольшее количество соединений с базой данных',
+        required=False,
+    )
+    parser.add_argument(
+        '--db-workers',
+        type=int,
+        default=2,
+        help='Количество параллельных записей в базу в асинхронном режиме',
+        required=False,
+    )
+    parser.add_argument(
+        '--window',
+        choices=['hour', 'day'],
+        default='day',
+        help='Длительность окна при загрузке данных из API',
+        required=False,
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Количество параллельных запросов к API',
+        required=False,
+    )
+    parser.add_argument(
+        '--no-cache',
+        help='Загрузка данных из API без использования кэша ответов',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--metrics-dir',
+        help='Папка для метрик запуска (Prometheus textfile и JSON)',
+        required=False,
+    )
+    parser.add_argument(
+        '--analytics',
+        help='Аналитика прогресса студентов за период --start - --end',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--analytics-dir',
+        help='Папка для таблиц аналитики в формате CSV',
+        required=False,
+    )
+    parser.add_argument(
+        '--profile',
+        choices=['load', 'publish', 'analytics'],
+        nargs='+',
+        help='Профилирование стадий через cProfile (файлы в папке profiles)',
+        required=False,
+    )
+    parser.add_argument(
+        '--tracemalloc',
+        help='Замер пиковой памяти профилируемых стадий',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Количество записей в одной пачке при загрузке',
+        required=False,
+    )
+    parser.add_argument(
+        '--commit-every',
+        type=int,
+        default=10000,
+        help='Количество записей между фиксациями транзакции',
+        required=False,
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=4,
+        help='Количество пачек в очереди между загрузкой и записью',
+        required=False,
+    )
+    parser.add_argument(
+        '--insert-method',
+        choices=['copy', 'values'],
+        default='copy',
+        help='Способ загрузки: COPY FROM STDIN или execute_values',
+        required=False,
+    )
+    parser.add_argument(
+        '--start',
+        type=iso_date,
+        help='Начальная дата загрузки или отчёта за период (YYYY-MM-DD)',
+        required=False,
+    )
+    parser.add_argument(
+        '--end',
+        type=iso_date,
+        help='Конечная дата загрузки или отчёта за период включительно (YYYY-MM-DD)',
+        required=False,
+    )
+    parser.add_argument(
+        '--date',
+        type=iso_date,
+        help='Дата отчёта за один день (YYYY-MM-DD)',
+        required=False,
+    )
+    parser.add_argument(
+        '--mail-to',
+        nargs='+',
+        help='Адреса электронной почты получателей отчёта',
+        required=False,
+    )
+    parser.add_argument(
+        '--mail-template',
+        help='Файл шаблона письма (string.Template: $report, $name, $recipient)',
+        required=False,
+    )
+    parser.add_argument(
+        '--spreadsheet-id',
+        help='Идентификатор таблицы Google для отчёта (по умолчанию SPREADSHEET_ID)',
+        required=False,
+    )
+    parser.add_argument(
+        '-d',
+        '--daemon',
+        help='Работа по расписанию: синхронизация и ежедневный отчёт',
+        required=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--interval',
+        type=int,
+        default=60,
+        help='Интервал синхронизации в режиме работы по расписанию, минут',
+        required=False,
+    )
+    parser.add_argument(
+        '--report-at',
+        default='06:00',
+        help='Время ежедневного отчёта за прошедшие сутки (ЧЧ:ММ)',
+        required=False,
+    )
     try:
+        args, _ = parser.parse_known_args()
+        if args.config:
+            parser.set_defaults(**load_config(args.config))
         args = parser.parse_args()
         return args
     except SystemExit:
@@ -174,55 +688,123 @@ def main():
     password = environ['PASSWORD']
     host = environ['HOST']
     port = int(environ['PORT'])
-    client = environ['CLIENT']
-    client_key = environ['CLIENT_KEY']
+    client = environ.get('CLIENT')
+    client_key = environ.get('CLIENT_KEY')
     db_name = 'simulative'
-    db_connection = None
+    args = create_parser()
+    if args.profile:
+        metrics.enable_profiling(args.profile, trace_memory=args.tracemalloc)
+    db_pool = None
+    session = None
     try:
-        db_connection = db.DatabaseConnection(user,
-                                              password,
-                                              host,
-                                              port,
-                                              db_name)
-        students_grade = db.StudentDAO(db_connection)
-        args = create_parser()
-        start_date = None
-        if args.load:
-            start_date, end_date = input_dates()
+        max_connections = args.db_connections
+        if args.async_mode:
+            max_connections = max(max_connections, args.db_workers + 1)
+        db_pool = db.DatabasePool(user, password, host, port, maxconn=max_connections)
+        students_grade = db.StudentDAO(db_pool, db_name)
+        cache = None
+        if not args.no_cache and (args.daemon or args.async_mode or args.load or args.sync):
+            from api_cache import ResponseCache
+            cache = ResponseCache()
+        if args.daemon or args.load or args.sync:
+            session = rs.create_session(args.workers)
+        fetch_options = {
+            'window': args.window,
+            'max_workers': args.workers,
+            'cache': cache,
+            'session': session,
+        }
+        load_options = {
+            'batch_size': args.batch_size,
+            'commit_every': args.commit_every,
+            'method': args.insert_method,
+            'queue_size': args.queue_size,
+        }
+        if args.daemon:
+            run_daemon(students_grade, client, client_key, args,
+                       fetch_options, load_options)
+            return
+        if args.async_mode:
+            import asyncio
+            import async_simulative
+
+            start_date, end_date = (args.start, args.end) if args.start and args.end \
+                else input_dates()
             if not start_date:
                 return
-            fetching_data = rs.fetch_students_data(
-                client, client_key, start_date, end_date)
-            students_data = rs.format_for_db(fetching_data)
-            students_grade.insert_students_data(students_data)
-        students_data = get_students_data(students_grade)
-        msg_txt = f'''Количество уникальных пользователей {students_data[0][0]};
-                      Количество совершённых попыток {students_data[1][0]};
-                      Количество учпешных попыток {students_data[2][0]}''' 
-        sheet_data = [
-            ['Количество уникальных пользователей', students_data[0][0]],
-            ['Количество совершённых попыток', students_data[1][0]],
-            ['Количество учпешных попыток', students_data[2][0]],
-        ]
-        match args.fetch:            
-            case ['sheet']:
-                write_to_sheet(sheet_data)
-                logger.info("Данные успешно записаны в таблицу!")
-            case ['mail']:
-                msg_to = get_mail_address()
-                send_email(msg_to=msg_to, msg_txt=msg_txt)
-                logger.info('Письмо отправлено')
-            case ['sheet', 'mail']:
-                write_to_sheet(sheet_data)
-                logger.info("Данные успешно записаны в таблицу!")
-                msg_to = get_mail_address()
-                send_email(msg_to=msg_to, msg_txt=msg_txt)
-                logger.info('Письмо отправлено')
+            asyncio.run(async_simulative.run_engine(
+                students_grade, client, client_key, start_date, load_end(end_date),
+                publishers=create_publishers(args.fetch, args.mail_to, args.spreadsheet_id,
+                                             read_template(args.mail_template)),
+                window=args.window,
+                fetch_workers=args.workers,
+                db_workers=args.db_workers,
+                batch_size=args.batch_size,
+                commit_every=args.commit_every,
+                method=args.insert_method,
+                queue_size=args.queue_size,
+                cache=cache
+            ))
+            return
+        if args.clients:
+            import clients
+
+            with metrics.timer('stage', stage='clients'):
+                clients.ingest_clients(
+                    clients.load_clients(args.clients),
+                    {'user': user, 'password': password, 'host': host, 'port': port},
+                    {'window': args.window, 'max_workers': args.workers},
+                    load_options,
+                    processes=args.processes,
+                    use_cache=not args.no_cache
+                )
+        elif args.ingest_file:
+            import ingest
+
+            with metrics.profile('load'), metrics.timer('stage', stage='ingest'):
+                students_grade.insert_students_data(
+                    ingest.iter_file_records(args.ingest_file, workers=args.processes),
+                    batch_size=args.batch_size,
+                    commit_every=args.commit_every,
+                    method=args.insert_method
+                )
+        elif args.load:
+            start_date, end_date = (args.start, args.end) if args.start and args.end \
+                else input_dates()
+            if not start_date:
+                return
+            fetching_data = rs.iter_students_data(
+                client, client_key, start_date, load_end(end_date), **fetch_options)
+            with metrics.profile('load'), metrics.timer('stage', stage='load'):
+                load_students_data(students_grade, fetching_data, **load_options)
+        elif args.sync:
+            with metrics.profile('load'), metrics.timer('stage', stage='sync'):
+                sync_students_data(
+                    students_grade, client, client_key, fetch_options, load_options,
+                    start_date=args.start)
+        if args.analytics:
+            publish_analytics(students_grade, args)
+            return
+        if args.period:
+            students_data = get_students_data(
+                students_grade, True, args.start, args.end)
+        else:
+            students_data = get_students_data(students_grade, False, args.date)
+        if not students_data:
+            return
+        publish_report(students_data, args.fetch, args.mail_to, args.spreadsheet_id,
+                       read_template(args.mail_template))
     except Exception as e:
         logger.error(f'Ошибка {repr(e)}')
     finally:
-        if db_connection:
-            db_connection.disconnect()
+        if args.fetch and 'mail' in args.fetch:
+            from mail import close_dispatcher
+            close_dispatcher()
+        if session:
+            session.close()
+        if db_pool:
+            db_pool.disconnect()
+        export_metrics(args.metrics_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+import unittest
+
+import gspread
+
+from gspread.utils import a1_to_rowcol
+
+import google_api
+
+
+class FakeWorksheet:
+    """
+    Заглушка листа gspread: строки хранятся списком, вызовы API
+    записываются в журнал. append_rows добавляет строки после
+    offset пустых строк, как Google Sheets после таблицы с пропусками.
+    """
+
+    def __init__(self, title, rows=(), offset=0):
+        self.title = title
+        self.rows = [list(row) for row in rows]
+        self.offset = offset
+        self.log = list()
+
+    def col_values(self, column):
+        self.log.append('col_values')
+        values = [row[column - 1] if len(row) >= column else '' for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_update(self, updates):
+        self.log.append(('batch_update', [update['range'] for update in updates]))
+        for update in updates:
+            first_cell = update['range'].split(':')[0]
+            row, _ = a1_to_rowcol(first_cell)
+            self.rows[row - 1] = list(update['values'][0])
+
+    def append_rows(self, values):
+        self.log.append(('append_rows', len(values)))
+        self.rows.extend([] for _ in range(self.offset))
+        first_row = len(self.rows) + 1
+        self.rows.extend(list(row) for row in values)
+        return {'updates': {
+            'updatedRange': f"'{self.title}'!A{first_row}:D{len(self.rows)}",
+        }}
+
+
+class FakeWorkbook:
+
+    def __init__(self, worksheets):
+        self.worksheets = {worksheet.title: worksheet for worksheet in worksheets}
+
+    @property
+    def sheet1(self):
+        return next(iter(self.worksheets.values()))
+
+    def worksheet(self, title):
+        if title not in self.worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.worksheets[title] = FakeWorksheet(title)
+        return self.worksheets[title]
+
+
+class FakeClient:
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.opened = 0
+
+    def open_by_key(self, spreadsheet_id):
+        self.opened += 1
+        return self.workbook
+
+
+HEADER = ['Дата', 'Пользователи', 'Попытки', 'Решения']
+
+
+class SheetPublisherTest(unittest.TestCase):
+
+    def create_publisher(self, rows=(), offset=0, worksheet_title=None):
+        self.worksheet = FakeWorksheet('Лист1', rows, offset)
+        self.client = FakeClient(FakeWorkbook([self.worksheet]))
+        return google_api.SheetPublisher('spreadsheet', worksheet_title, self.client)
+
+    def test_header_written_once(self):
+        publisher = self.create_publisher()
+        publisher.publish([HEADER, ['2023-04-01', 1, 2, 3]])
+        publisher.publish([HEADER, ['2023-04-02', 4, 5, 6]])
+        self.assertEqual(self.worksheet.rows, [
+            HEADER, ['2023-04-01', 1, 2, 3], ['2023-04-02', 4, 5, 6]])
+        self.assertEqual(self.worksheet.log.count('col_values'), 1)
+        self.assertEqual(self.client.opened, 1)
+
+    def test_existing_day_updated_and_new_days_appended(self):
+        publisher = self.create_publisher([
+            HEADER, ['2023-04-01', 1, 2, 3], ['2023-04-02', 4, 5, 6]])
+        publisher.publish([HEADER, ['2023-04-02', 7, 8, 9],
+                           ['2023-04-03', 1, 1, 1], ['2023-04-04', 2, 2, 2]])
+        self.assertEqual(self.worksheet.log, [
+            'col_values', ('batch_update', ['A3:D3']), ('append_rows', 2)])
+        self.assertEqual(self.worksheet.rows, [
+            HEADER, ['2023-04-01', 1, 2, 3], ['2023-04-02', 7, 8, 9],
+            ['2023-04-03', 1, 1, 1], ['2023-04-04', 2, 2, 2]])
+
+    def test_appended_rows_cached_from_updated_range(self):
+        publisher = self.create_publisher([HEADER, ['2023-04-01', 1, 2, 3]], offset=2)
+        publisher.publish([HEADER, ['2023-04-02', 4, 5, 6], ['2023-04-03', 7, 8, 9]])
+        self.assertEqual(publisher.load_rows()['2023-04-02'], 5)
+        self.assertEqual(publisher.load_rows()['2023-04-03'], 6)
+        self.worksheet.log.clear()
+        publisher.publish([HEADER, ['2023-04-03', 0, 0, 0]])
+        self.assertEqual(self.worksheet.log, [('batch_update', ['A6:D6'])])
+        self.assertEqual(self.worksheet.rows[5], ['2023-04-03', 0, 0, 0])
+
+    def test_missing_worksheet_created(self):
+        publisher = self.create_publisher(worksheet_title='Аналитика')
+        publisher.publish([HEADER, ['2023-04-01', 1, 2, 3]])
+        worksheet = self.client.workbook.worksheets['Аналитика']
+        self.assertEqual(worksheet.rows, [HEADER, ['2023-04-01', 1, 2, 3]])
+        self.assertEqual(self.worksheet.rows, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
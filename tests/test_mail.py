@@ -0,0 +1,97 @@
+import smtplib
+import unittest
+
+from unittest import mock
+
+import mail
+
+
+class FakeSMTP:
+    """
+    Заглушка smtplib.SMTP: ответы на login и send_message задаются
+    очередями ошибок, вызовы записываются в общий журнал
+    """
+
+    def __init__(self, log, login_errors, send_errors):
+        self.log = log
+        self.login_errors = login_errors
+        self.send_errors = send_errors
+        self.authenticated = False
+
+    def __call__(self, host, port, timeout=None):
+        self.authenticated = False
+        self.log.append('connect')
+        return self
+
+    def login(self, user, password):
+        if self.login_errors:
+            raise self.login_errors.pop(0)
+        self.authenticated = True
+
+    def send_message(self, msg):
+        self.log.append(('send', msg['To'], self.authenticated))
+        if not self.authenticated:
+            raise smtplib.SMTPSenderRefused(530, b'Authentication required', msg['From'])
+        if self.send_errors:
+            raise self.send_errors.pop(0)
+
+    def quit(self):
+        self.log.append('quit')
+
+    def close(self):
+        self.log.append('close')
+
+
+class MailDispatcherTest(unittest.TestCase):
+
+    def create_dispatcher(self, login_errors=(), send_errors=()):
+        self.log = list()
+        self.smtp = FakeSMTP(self.log, list(login_errors), list(send_errors))
+        patcher = mock.patch('smtplib.SMTP', self.smtp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return mail.MailDispatcher(host='localhost', port=25, email_address='from@mail.ru',
+                                   password='secret', use_ssl=False, backoff=0)
+
+    def test_batch_uses_one_connection(self):
+        dispatcher = self.create_dispatcher()
+        messages = [dispatcher.create_message(f'user{number}@mail.ru', 'report')
+                    for number in range(3)]
+        self.assertEqual(dispatcher.send_batch(messages), (3, 0))
+        self.assertEqual(self.log.count('connect'), 1)
+        self.assertEqual(self.log[-1], 'quit')
+
+    def test_retries_transient_login_error_on_new_connection(self):
+        dispatcher = self.create_dispatcher(
+            login_errors=[smtplib.SMTPAuthenticationError(454, b'Temporary failure')])
+        message = dispatcher.create_message('user@mail.ru', 'report')
+        self.assertEqual(dispatcher.send_batch([message]), (1, 0))
+        self.assertEqual(self.log, ['connect', 'close', 'connect',
+                                    ('send', 'user@mail.ru', True), 'quit'])
+
+    def test_retries_transient_send_error(self):
+        dispatcher = self.create_dispatcher(
+            send_errors=[smtplib.SMTPResponseException(451, b'Try again later')])
+        message = dispatcher.create_message('user@mail.ru', 'report')
+        self.assertEqual(dispatcher.send_batch([message]), (1, 0))
+        self.assertEqual(self.log.count(('send', 'user@mail.ru', True)), 2)
+
+    def test_permanent_error_is_not_retried(self):
+        dispatcher = self.create_dispatcher(
+            send_errors=[smtplib.SMTPRecipientsRefused({'user@mail.ru': (550, b'No such user')})])
+        message = dispatcher.create_message('user@mail.ru', 'report')
+        self.assertEqual(dispatcher.send_batch([message]), (0, 1))
+        self.assertEqual(self.log.count(('send', 'user@mail.ru', True)), 1)
+
+    def test_background_queue_with_template(self):
+        dispatcher = self.create_dispatcher()
+        with dispatcher:
+            dispatcher.submit_report(['Иван <first@mail.ru>', 'second@mail.ru'], 'отчёт',
+                                     template='Здравствуйте, $name!\n$report')
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (2, 0))
+        self.assertEqual([entry[1] for entry in self.log if entry[0] == 'send'],
+                         ['Иван <first@mail.ru>', 'second@mail.ru'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import random
+import unittest
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+import requests
+
+import requests_to_simulative as rs
+
+from benchmark import format_for_db_legacy
+
+
+COURSES = ['DST-3.0+28FEB2021', 'DSPR-2.0+14JULY2021', 'PYTHON-1.0+01SEP2022']
+KEYS = ('oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url')
+STYLES = ('single', 'double', 'bare', 'compact')
+
+
+def make_values(generator):
+    """
+    Значения passback_params: пустой или заданный ключ потребителя,
+    идентификатор задания и, не всегда, адрес сервиса
+    """
+    course = generator.choice(COURSES)
+    task = f'{generator.getrandbits(128):032x}'
+    consumer_key = generator.choice(['', f'{generator.getrandbits(128):032x}'])
+    sourcedid = f'course-v1:SkillFactory+{course}:lms.skillfactory.ru-{task}:{task}'
+    if generator.random() < 0.5:
+        return consumer_key, sourcedid
+    url = (f'https://lms.skillfactory.ru/courses/course-v1:SkillFactory+{course}'
+           f'/xblock/block-v1:SkillFactory+{course}+type@lti+block@{task}'
+           f'/handler_noauth/grade_handler')
+    return consumer_key, sourcedid, url
+
+
+def render(values, style):
+    """
+    Строка passback_params в одном из вариантов записи: одинарные
+    или двойные кавычки, значения без кавычек, запись без пробелов
+    """
+    if style == 'single':
+        fields = [f"'{key}': '{value}'" for key, value in zip(KEYS, values)]
+        return '{' + ', '.join(fields) + '}'
+    if style == 'double':
+        fields = [f'"{key}": "{value}"' for key, value in zip(KEYS, values)]
+        return '{' + ', '.join(fields) + '}'
+    if style == 'bare':
+        fields = [f'{key}: {value}' for key, value in zip(KEYS, values)]
+        return '{' + ', '.join(fields) + '}'
+    fields = [f"'{key}':'{value}'" for key, value in zip(KEYS, values)]
+    return '{' + ','.join(fields) + '}'
+
+
+def expected_values(values):
+    consumer_key, sourcedid, *url = values
+    return consumer_key or None, sourcedid, url[0] if url else None
+
+
+def make_student_data(generator, passback_params):
+    attempt_type = generator.choice(['run', 'submit'])
+    return {
+        'lti_user_id': f'{generator.getrandbits(64):016x}',
+        'passback_params': passback_params,
+        'is_correct': generator.choice([0, 1]) if attempt_type == 'submit' else None,
+        'attempt_type': attempt_type,
+        'created_at': datetime(2023, 4, 1, generator.randrange(24),
+                               generator.randrange(60)).strftime(rs.API_DATE_FORMAT),
+    }
+
+
+class ParsePassbackValuesTest(unittest.TestCase):
+
+    def setUp(self):
+        rs.parse_passback_values.cache_clear()
+
+    def test_generated_variants(self):
+        generator = random.Random(0)
+        for _ in range(2000):
+            values = make_values(generator)
+            for style in STYLES:
+                passback_params = render(values, style)
+                with self.subTest(passback_params=passback_params):
+                    self.assertEqual(rs.parse_passback_values(passback_params),
+                                     expected_values(values))
+
+    def test_invalid_params(self):
+        for passback_params in ('{}', "{'oauth_consumer_key': ''}", 'garbage'):
+            with self.subTest(passback_params=passback_params):
+                self.assertIsNone(rs.parse_passback_values(passback_params))
+
+
+class FormatForDbTest(unittest.TestCase):
+
+    def setUp(self):
+        rs.parse_passback_values.cache_clear()
+
+    def test_matches_legacy_implementation(self):
+        generator = random.Random(1)
+        students_data = [make_student_data(generator, render(make_values(generator), 'single'))
+                         for _ in range(2000)]
+        legacy = [rs.StudentRecord(**db_data) for db_data in format_for_db_legacy(students_data)]
+        self.assertEqual(list(rs.format_for_db(students_data)), legacy)
+
+    def test_all_styles(self):
+        generator = random.Random(2)
+        for style in STYLES:
+            values = make_values(generator)
+            student_data = make_student_data(generator, render(values, style))
+            with self.subTest(style=style):
+                (record,) = rs.format_for_db([student_data])
+                self.assertEqual(
+                    (record.oauth_consumer_key, record.lis_result_sourcedid,
+                     record.lis_outcome_service_url),
+                    expected_values(values))
+                self.assertEqual(record.user_id, student_data['lti_user_id'])
+                self.assertEqual(record.attempt_type, student_data['attempt_type'])
+                self.assertEqual(record.is_correct, student_data['is_correct'])
+                self.assertEqual(record.created_at,
+                                 datetime.fromisoformat(student_data['created_at']))
+
+    def test_skips_incomplete_records(self):
+        generator = random.Random(3)
+        passback_params = render(make_values(generator), 'single')
+        students_data = [
+            {**make_student_data(generator, passback_params), 'lti_user_id': None},
+            make_student_data(generator, ''),
+            make_student_data(generator, 'garbage'),
+            make_student_data(generator, passback_params),
+        ]
+        self.assertEqual(len(list(rs.format_for_db(students_data))), 1)
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f'{status_code}', response=response)
+
+
+class FetchWindowTest(unittest.TestCase):
+    """
+    fetch_window с заглушкой stream_students_data: ответы на запросы окон
+    задаются функцией от границ окна, запросы и паузы записываются
+    """
+
+    def setUp(self):
+        self.requests = list()
+        self.sleeps = list()
+        for target, replacement in (('stream_students_data', self.stream),
+                                    ('sleep', self.sleeps.append)):
+            patcher = mock.patch.object(rs, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.window_start = datetime(2023, 4, 1)
+        self.window_end = datetime(2023, 4, 2)
+
+    def stream(self, session, client, client_key, start_date, end_date, api_url):
+        self.requests.append((start_date, end_date))
+        return self.respond(datetime.strptime(start_date, rs.API_DATE_FORMAT),
+                            datetime.strptime(end_date, rs.API_DATE_FORMAT),
+                            len(self.requests))
+
+    def fetch(self, respond, **kwargs):
+        self.respond = respond
+        return rs.fetch_window(None, 'client', 'key', self.window_start, self.window_end,
+                               backoff=1.0, **kwargs)
+
+    def test_client_error_is_not_retried(self):
+        def respond(start, end, number):
+            raise http_error(403)
+
+        with self.assertRaises(requests.HTTPError):
+            self.fetch(respond)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_server_error_is_retried(self):
+        def respond(start, end, number):
+            if number == 1:
+                raise http_error(503)
+            return [{'created_at': str(start)}]
+
+        self.assertEqual(self.fetch(respond), [{'created_at': '2023-04-01 00:00:00'}])
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_connection_error_is_retried(self):
+        def respond(start, end, number):
+            if number < 3:
+                raise requests.ConnectionError('reset')
+            return []
+
+        self.assertEqual(self.fetch(respond), [])
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+
+    def test_failed_window_is_split(self):
+        def respond(start, end, number):
+            if end - start > timedelta(hours=12):
+                raise http_error(500)
+            return [{'created_at': str(start)}]
+
+        self.assertEqual(self.fetch(respond), [{'created_at': '2023-04-01 00:00:00'},
+                                               {'created_at': '2023-04-01 12:00:00'}])
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+
+    def test_min_window_stops_split(self):
+        def respond(start, end, number):
+            raise http_error(429)
+
+        with self.assertRaises(requests.RequestException):
+            self.fetch(respond, retries=2, min_window=timedelta(hours=12))
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(self.sleeps, [1.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+import unittest
+
+from benchmark import STARTUP_MODULES, bench_startup, check_startup
+
+
+STARTUP_BUDGET_MS = 150
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_startup_budget(self):
+        startup = bench_startup(STARTUP_BUDGET_MS, repeats=3)
+        self.assertEqual(sorted(startup), sorted(STARTUP_MODULES))
+        self.assertEqual(check_startup(startup), [])
+
+
+if __name__ == '__main__':
+    unittest.main()